@@ -1,18 +1,32 @@
 import time
+import threading
 import base64
+import json
 import logging
-import datetime
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+import hashlib
+import uuid
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort, send_file, Response, stream_with_context
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, FileField, SubmitField
 from wtforms.validators import DataRequired, EqualTo
 import os
-from google.cloud import storage
-import requests
+import worker
+import images
+import auth
+import metrics
+import tripo
+from sqlalchemy import or_, and_, case, func
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.exc import IntegrityError
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+
+from models import db, User, Model, Job, BlobDeletion, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED
+import migrations
+from storage_backend import get_storage
+from pagination import keyset_page
 
 from flask_cors import CORS  # <-- Add this import
 
@@ -24,11 +38,21 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})  # <-- Add this line
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'default-secret-key-for-dev')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connections per process; raise for SERVER_MODE=gevent, where many more requests run at once
+if os.environ.get('DB_POOL_SIZE'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': int(os.environ['DB_POOL_SIZE']),
+                                               'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10))}
 app.debug = True  # <--- Add this line for debugging
-db = SQLAlchemy(app)
+db.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Authentication (see auth.py). PASSWORD_HASH_METHOD is a werkzeug hash spec;
+# existing hashes are upgraded on the user's next login after it changes.
+app.config['PASSWORD_HASH_METHOD'] = auth.canonical_hash_method(os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+app.config['API_TOKEN_MAX_AGE'] = int(os.environ.get('API_TOKEN_MAX_AGE', 24 * 3600))
+
 # If running behind a proxy (like on Cloud Run), add:
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
@@ -36,35 +60,97 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 logging.basicConfig(level=logging.INFO)
 app.logger.setLevel(logging.INFO)
 
+# Metrics and request logs (see metrics.py). One JSON line per sampled
+# request; 5xx and slow requests are always logged.
+app.config['LOG_SAMPLE_RATE'] = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+metrics.init_app(app)
+
 # Load Tripo API Key (use the secret for Tripo, not Meshy)
 API_KEY = os.environ.get("TRIPO_API_KEY")
-HEADERS = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"} if API_KEY else {}
-
-# Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(64), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
-    is_admin = db.Column(db.Boolean, default=False)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-class Model(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    image_url = db.Column(db.String(256), nullable=False)
-    model_url = db.Column(db.String(256), nullable=True)
-    task_id = db.Column(db.String(64), nullable=True)
-    name = db.Column(db.String(128), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Add timestamp
+
+# Tripo client settings (see tripo.py)
+app.config['TRIPO_API_KEY'] = API_KEY
+app.config['TRIPO_API_BASE'] = os.environ.get('TRIPO_API_BASE', 'https://api.tripo3d.ai/v2/openapi')
+app.config['TRIPO_POOL_SIZE'] = int(os.environ.get('TRIPO_POOL_SIZE', 10))
+app.config['TRIPO_MAX_RETRIES'] = int(os.environ.get('TRIPO_MAX_RETRIES', 4))
+# Requests per second allowed by our Tripo account; unset means unlimited
+app.config['TRIPO_RATE_LIMIT'] = float(os.environ['TRIPO_RATE_LIMIT']) if os.environ.get('TRIPO_RATE_LIMIT') else None
+app.config['TRIPO_RATE_BURST'] = int(os.environ.get('TRIPO_RATE_BURST', 5))
+
+# Background worker settings (see worker.py)
+app.config['RUN_WORKER'] = os.environ.get('RUN_WORKER', '1') == '1'
+app.config['WORKER_CONCURRENCY'] = int(os.environ.get('WORKER_CONCURRENCY', 2))
+# Finished jobs are kept this long for debugging, then pruned by the reconciler
+app.config['JOB_RETENTION_SECONDS'] = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+# Status polls of a running Tripo task back off with its progress (worker.poll_delay).
+# With TRIPO_WEBHOOK_SECRET set Tripo's notifications to /api/tripo/webhook drive
+# finalization and polling drops to a FINALIZE_WEBHOOK_POLL_INTERVAL fallback.
+app.config['FINALIZE_POLL_INTERVAL'] = float(os.environ.get('FINALIZE_POLL_INTERVAL', 5))
+app.config['FINALIZE_POLL_MAX_INTERVAL'] = float(os.environ.get('FINALIZE_POLL_MAX_INTERVAL', 60))
+app.config['FINALIZE_WEBHOOK_POLL_INTERVAL'] = float(os.environ.get('FINALIZE_WEBHOOK_POLL_INTERVAL', 300))
+app.config['TRIPO_WEBHOOK_SECRET'] = os.environ.get('TRIPO_WEBHOOK_SECRET')
+# Tripo generation parameters; with DEDUPLICATE_GENERATIONS a repeat of the
+# same image and parameters reuses the earlier result (see worker.claim_generation)
+app.config['TRIPO_MODEL_VERSION'] = os.environ.get('TRIPO_MODEL_VERSION', 'v2.5-20250123')
+app.config['TRIPO_TEXTURE'] = os.environ.get('TRIPO_TEXTURE', '1') == '1'
+app.config['TRIPO_PBR'] = os.environ.get('TRIPO_PBR', '0') == '1'
+app.config['DEDUPLICATE_GENERATIONS'] = os.environ.get('DEDUPLICATE_GENERATIONS', '1') == '1'
+# Max Tripo submissions running at once per process
+app.config['SUBMIT_CONCURRENCY'] = int(os.environ.get('SUBMIT_CONCURRENCY', 2))
+# Uploads are downscaled to fit TRIPO_MAX_IMAGE_SIDE before submission and get a
+# THUMBNAIL_SIDE preview; the decoding runs in IMAGE_PROCESSES child processes (0 = inline)
+app.config['TRIPO_MAX_IMAGE_SIDE'] = int(os.environ.get('TRIPO_MAX_IMAGE_SIDE', 2048))
+app.config['THUMBNAIL_SIDE'] = int(os.environ.get('THUMBNAIL_SIDE', 256))
+app.config['IMAGE_PROCESSES'] = int(os.environ.get('IMAGE_PROCESSES', 2))
+
+# /api/status/stream: seconds between DB checks, and lifetime of one stream
+app.config['STATUS_STREAM_INTERVAL'] = float(os.environ.get('STATUS_STREAM_INTERVAL', 2))
+app.config['STATUS_STREAM_SECONDS'] = float(os.environ.get('STATUS_STREAM_SECONDS', 30))
+# Open streams allowed per process; past it the page polls /api/status instead.
+# Each stream holds a thread in SERVER_MODE=threads, so by default only a
+# quarter of them may stream there (0 = no limit, the gevent default).
+if os.environ.get('SERVER_MODE', 'threads') == 'gevent':
+    default_max_streams = 0
+else:
+    default_max_streams = max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 4)
+app.config['STATUS_STREAM_MAX'] = int(os.environ.get('STATUS_STREAM_MAX', default_max_streams))
+
+# Direct-to-storage uploads (/api/uploads): signed URL lifetime and max image size
+app.config['DIRECT_UPLOAD_EXPIRY'] = int(os.environ.get('DIRECT_UPLOAD_EXPIRY', 900))
+app.config['MAX_IMAGE_BYTES'] = int(os.environ.get('MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+
+# Object storage (see storage_backend.py)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'gcs')
+app.config['BUCKET_NAME'] = os.environ.get('BUCKET_NAME')
+app.config['LOCAL_STORAGE_ROOT'] = os.environ.get('LOCAL_STORAGE_ROOT', os.path.join(app.instance_path, 'storage'))
+app.config['STORAGE_POOL_SIZE'] = int(os.environ.get('STORAGE_POOL_SIZE', 10))
+
+user_cache = auth.UserCache(ttl=app.config['USER_CACHE_TTL'])
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
+
+@login_manager.request_loader
+def load_user_from_token(request):
+    # Stateless "Authorization: Bearer <token>" for the API (see auth.py)
+    header = request.headers.get('Authorization', '')
+    if not request.path.startswith('/api/') or not header.startswith('Bearer '):
+        return None
+    return auth.load_token(header[len('Bearer '):], app.config['SECRET_KEY'], app.config['API_TOKEN_MAX_AGE'])
+
+def authenticate(username, password):
+    """The user if the password is right, rehashing it if PASSWORD_HASH_METHOD changed."""
+    user = User.query.filter_by(username=username).first()
+    if not user or not user.check_password(password):
+        return None
+    if user.password_needs_rehash(app.config['PASSWORD_HASH_METHOD']):
+        user.set_password(password, app.config['PASSWORD_HASH_METHOD'])
+        db.session.commit()
+        app.logger.info(f"Rehashed password for user {user.id}")
+    return user
 
 # Forms
 class SignupForm(FlaskForm):
@@ -97,6 +183,40 @@ def image_to_data_uri(image_bytes: bytes, content_type: str) -> str:
 def index():
     return render_template('index.html')
 
+@app.route('/storage/<path:name>')
+def local_storage_file(name):
+    # Only the local backend keeps objects on this server
+    store = get_storage()
+    if app.config['STORAGE_BACKEND'] != 'local' or not store.exists(name):
+        abort(404)
+    content_type, cache_control = store.metadata(name)
+    response = send_file(store.path(name), mimetype=content_type)
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+@app.route('/storage/<path:name>', methods=['PUT'])
+def local_storage_put(name):
+    # Stand-in for a GCS signed URL: the token from /api/uploads authorizes one object
+    store = get_storage()
+    if not hasattr(store, 'check_upload_token'):
+        abort(404)
+    try:
+        claims = store.check_upload_token(request.args.get('token', ''), name)
+    except ValueError:
+        abort(403)
+    if request.mimetype != claims['content_type']:
+        abort(400)
+    # Like GCS, require a length up front; werkzeug then caps the stream at it
+    if request.content_length is None:
+        abort(411)
+    if request.content_length > claims['max_bytes']:
+        abort(413)
+    with store.open_writer(name, claims['content_type'], chunk_size=worker.DEFAULT_CHUNK_SIZE) as writer:
+        for chunk in iter(lambda: request.stream.read(worker.READ_SIZE), b''):
+            writer.write(chunk)
+    return '', 200
+
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
     form = SignupForm()
@@ -106,7 +226,7 @@ def signup():
                 flash('Username already exists.')
                 return redirect(url_for('signup'))
             user = User(username=form.username.data)
-            user.set_password(form.password.data)
+            user.set_password(form.password.data, app.config['PASSWORD_HASH_METHOD'])
             db.session.add(user)
             db.session.commit()
             flash('Account created successfully!')
@@ -122,8 +242,8 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         try:
-            user = User.query.filter_by(username=form.username.data).first()
-            if user and user.check_password(form.password.data):
+            user = authenticate(form.username.data, form.password.data)
+            if user:
                 login_user(user)
                 if user.is_admin:
                     return redirect(url_for('admin_panel'))
@@ -139,186 +259,244 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+def queue_upload(user_id, filename, image_bytes, content_type, name=None, upload_key=None):
+    """Store the image and queue its Tripo submission (worker.submit_model).
+
+    With an upload_key, repeating the same upload returns the model created
+    the first time instead of a new one.
+    """
+    if upload_key:
+        existing = Model.query.filter_by(user_id=user_id, upload_key=upload_key).first()
+        if existing:
+            return existing
+
+    # Unique prefix so two uploads of "image.jpg" can't overwrite each other before submission
+    object_name = f'images/{user_id}/{uuid.uuid4().hex[:12]}-{filename}'
+    image_url = get_storage().upload_bytes(object_name, image_bytes, content_type=content_type)
+    app.logger.info(f"Image uploaded to {image_url}")
+    return register_model(user_id, image_url, name, os.path.splitext(filename)[0], upload_key,
+                          image_sha256=hashlib.sha256(image_bytes).hexdigest())
+
+def register_model(user_id, image_url, name, default_name, upload_key=None, image_sha256=None):
+    """Create the queued Model for an image already in storage and enqueue its submission."""
+    model_name = name.strip() if name and name.strip() else default_name
+    model = Model(user_id=user_id, image_url=image_url, task_id=None, model_url=None, name=model_name,
+                  status=STATUS_QUEUED, upload_key=upload_key, image_sha256=image_sha256)
+    db.session.add(model)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key won
+        db.session.rollback()
+        return Model.query.filter_by(user_id=user_id, upload_key=upload_key).one()
+    worker.enqueue('submit', f'submit:{model.id}', model_id=model.id)
+    return model
+
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
     form = UploadForm()
     if form.validate_on_submit():
+        if not API_KEY:
+            flash('Tripo API key not configured.')
+            return redirect(url_for('upload'))
         try:
             app.logger.info(f"Uploading image for user {current_user.id}")
             image_file = form.image.data
             image_bytes = image_file.read()
-            app.logger.info("Image read successfully")
-
-            # Upload image to Google Cloud Storage
-            storage_client = storage.Client()
-            bucket = storage_client.bucket(os.environ['BUCKET_NAME'])
-            filename = f'images/{current_user.id}/{image_file.filename}'
-            blob = bucket.blob(filename)
-            blob.upload_from_string(image_bytes, content_type=image_file.content_type)
-            image_url = blob.public_url
-            app.logger.info(f"Image uploaded to {image_url}")
-
-            if not API_KEY:
-                flash('Tripo API key not configured.')
-                return redirect(url_for('upload'))
-
-            # Step 1: Upload image to Tripo API
-            app.logger.info("Uploading image to Tripo API")
-            tripo_upload_url = "https://api.tripo3d.ai/v2/openapi/upload"
-            files = {'file': (image_file.filename, image_bytes, image_file.content_type)}
-            upload_headers = {"Authorization": f"Bearer {API_KEY}"}
-            upload_response = requests.post(tripo_upload_url, headers=upload_headers, files=files)
-            if upload_response.status_code == 403:
-                app.logger.error("Tripo upload 403 Forbidden: Check your TRIPO_API_KEY and Tripo account permissions.")
-                flash("Tripo API error: Forbidden (check your API key and permissions).")
-                return redirect(url_for('upload'))
-            upload_response.raise_for_status()
-            upload_data = upload_response.json()
-            if upload_data.get("code") != 0:
-                app.logger.error(f"Tripo upload failed: {upload_data}")
-                flash(f"Tripo upload failed: {upload_data.get('message', 'Unknown error')}")
-                return redirect(url_for('upload'))
-            image_token = upload_data["data"]["image_token"]
-            app.logger.info(f"Tripo image token: {image_token}")
-
-            # Step 2: Start image-to-3D task with Tripo API
-            app.logger.info("Calling Tripo API to start image-to-3D task")
-            tripo_task_url = "https://api.tripo3d.ai/v2/openapi/task"
-            payload = {
-                "type": "image_to_model",
-                "file": {
-                    "type": "jpg" if "jpg" in image_file.filename.lower() else "png",
-                    "file_token": image_token
-                },
-                "model_version": "v2.5-20250123",
-                "texture": True,
-                "pbr": False
-            }
-            task_response = requests.post(tripo_task_url, headers=HEADERS, json=payload)
-            task_response.raise_for_status()
-            task_data = task_response.json()
-            if task_data.get("code") != 0:
-                app.logger.error(f"Tripo task creation failed: {task_data}")
-                flash(f"Tripo task creation failed: {task_data.get('message', 'Unknown error')}")
+            image_format = images.sniff_format(image_bytes)
+            if not image_format:
+                flash('Unsupported image format. Upload a JPEG, PNG, WebP, GIF or BMP image.')
                 return redirect(url_for('upload'))
-            task_id = task_data["data"]["task_id"]
-            app.logger.info(f"Task created: {task_id}")
-
-            # Save task details to database
-            base_name = os.path.splitext(image_file.filename)[0]
-            model_name = form.name.data.strip() if form.name.data and form.name.data.strip() else base_name
-            model = Model(user_id=current_user.id, image_url=image_url, task_id=task_id, model_url=None, name=model_name)
-            db.session.add(model)
-            db.session.commit()
-            flash(f"Task key generated: {task_id}")
+            model = queue_upload(current_user.id, image_file.filename, image_bytes,
+                                 images.CONTENT_TYPES[image_format], name=form.name.data)
+            flash(f"Model \"{model.name}\" queued for processing.")
             return redirect(url_for('models'))
-        except requests.RequestException as e:
-            if hasattr(e, 'response') and e.response is not None and e.response.status_code == 403:
-                app.logger.error("Tripo API 403 Forbidden: Check your TRIPO_API_KEY and Tripo account permissions.")
-                flash("Tripo API error: Forbidden (check your API key and permissions).")
-                return redirect(url_for('upload'))
-            app.logger.error(f"Tripo API error: {str(e)}")
-            flash(f'Tripo API error: {str(e)}')
-            return redirect(url_for('upload'))
         except Exception as e:
+            db.session.rollback()
             app.logger.error(f"Upload error: {str(e)}")
             flash(f'Upload failed: {str(e)}')
             return redirect(url_for('upload'))
     return render_template('upload.html', form=form)
 
+@app.route('/api/upload', methods=['POST'])
+@login_required
+def api_upload():
+    # Multipart "image" (+ optional "name"); send an Idempotency-Key header to make retries safe
+    image_file = request.files.get('image')
+    if not image_file or not image_file.filename:
+        return jsonify({'success': False, 'message': 'No image provided'}), 400
+    if not API_KEY:
+        return jsonify({'success': False, 'message': 'Tripo API key not configured'}), 503
+    image_bytes = image_file.read()
+    # Check the bytes, not the client's filename or Content-Type
+    image_format = images.sniff_format(image_bytes)
+    if not image_format:
+        return jsonify({'success': False, 'message': 'Unsupported image format'}), 400
+    upload_key = (request.headers.get('Idempotency-Key') or '').strip()[:64] or None
+    try:
+        model = queue_upload(current_user.id, image_file.filename, image_bytes,
+                             images.CONTENT_TYPES[image_format], name=request.form.get('name'),
+                             upload_key=upload_key)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"API upload error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Upload failed'}), 500
+    return jsonify({'success': True, 'model_id': model.id, 'status': status_payload(model)}), 202
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def api_create_upload():
+    """Issue a signed URL for uploading an image straight to storage.
+
+    Body: {"filename": "bike.jpg", "content_type": "image/jpeg"}. PUT the
+    image to upload_url with the returned headers, then call
+    /api/uploads/finalize with the returned object name.
+    """
+    if not API_KEY:
+        return jsonify({'success': False, 'message': 'Tripo API key not configured'}), 503
+    data = request.get_json(silent=True) or {}
+    content_type = data.get('content_type')
+    if content_type not in images.CONTENT_TYPES.values():
+        return jsonify({'success': False, 'message': 'Unsupported image format'}), 400
+    filename = secure_filename(data.get('filename') or '') or 'image'
+    object_name = f'images/{current_user.id}/{uuid.uuid4().hex[:12]}-{filename}'
+    expires_in = app.config['DIRECT_UPLOAD_EXPIRY']
+    upload_url, headers = get_storage().signed_upload_url(object_name, content_type, expires_in,
+                                                          app.config['MAX_IMAGE_BYTES'])
+    return jsonify({'success': True, 'object': object_name, 'upload_url': upload_url, 'method': 'PUT',
+                    'headers': headers, 'expires_in': expires_in}), 201
+
+@app.route('/api/uploads/finalize', methods=['POST'])
+@login_required
+def api_finalize_upload():
+    # Body: {"object": <from /api/uploads>, "name": optional}; honors Idempotency-Key like /api/upload
+    data = request.get_json(silent=True) or {}
+    object_name = data.get('object') or ''
+    if not object_name.startswith(f'images/{current_user.id}/') or '..' in object_name.split('/'):
+        return jsonify({'success': False, 'message': 'Invalid object'}), 400
+    store = get_storage()
+    image_url = store.public_url(object_name)
+    upload_key = (request.headers.get('Idempotency-Key') or '').strip()[:64] or None
+    existing = Model.query.filter_by(user_id=current_user.id, image_url=image_url).first()
+    if existing is None and upload_key:
+        existing = Model.query.filter_by(user_id=current_user.id, upload_key=upload_key).first()
+    if existing is not None:
+        return jsonify({'success': True, 'model_id': existing.id, 'status': status_payload(existing)}), 202
+    if not store.exists(object_name):
+        return jsonify({'success': False, 'message': 'Image has not been uploaded'}), 409
+    # The worker hashes and validates the image (worker.prepare_image), so the bytes never pass through here
+    default_name = os.path.splitext(object_name.rsplit('/', 1)[-1].split('-', 1)[-1])[0]
+    model = register_model(current_user.id, image_url, data.get('name'), default_name, upload_key)
+    return jsonify({'success': True, 'model_id': model.id, 'status': status_payload(model)}), 202
+
+def status_payload(model):
+    """The /status response body for a model; the same shape is used by the batch and stream APIs."""
+    if model.model_url:
+        return {"status": "SUCCEEDED", "model_url": model.model_url}
+    if model.state == STATUS_FAILED:
+        return {"status": "FAILED", "error": model.error or "Processing failed"}
+    if model.state == STATUS_QUEUED:
+        return {"status": "IN_PROGRESS", "progress": 0, "queued": True}
+    if not model.task_id:
+        return {"status": "ERROR", "error": "No task ID available"}
+    return {"status": "IN_PROGRESS", "progress": model.progress or 0}
+
+def parse_ids(value, limit=200):
+    try:
+        ids = [int(i) for i in value.split(',') if i.strip()]
+    except ValueError:
+        abort(400)
+    return ids[:limit]
+
 @app.route('/status/<int:model_id>', methods=['GET'])
 @login_required
 def status(model_id):
+    # Tripo polling and the GLB transfer happen in worker.py; this only reads the row
     model = Model.query.get_or_404(model_id)
     if model.user_id != current_user.id:
         return jsonify({"error": "Unauthorized"}), 403
+    payload = status_payload(model)
+    return jsonify(payload), 500 if payload["status"] == "ERROR" else 200
 
-    # Step 1: Check if model_url is already set
-    if model.model_url:
-        app.logger.info(f"Model {model.id} already has model_url: {model.model_url}")
-        return jsonify({"status": "SUCCEEDED", "model_url": model.model_url})
-
-    # Step 2: Check GCS for the model file
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(os.environ['BUCKET_NAME'])
-        model_filename = f'models/{current_user.id}/{model.id}.glb'
-        model_blob = bucket.blob(model_filename)
-        if model_blob.exists():
-            app.logger.info(f"Model {model.id} found in GCS at {model_filename}")
-            try:
-                model.model_url = f"https://storage.googleapis.com/{os.environ['BUCKET_NAME']}/{model_filename}"
-                db.session.commit()
-                app.logger.info(f"Updated model {model.id} with model_url: {model.model_url}")
-                return jsonify({"status": "SUCCEEDED", "model_url": model.model_url})
-            except Exception as e:
-                app.logger.error(f"Failed to update model_url for model {model.id}: {str(e)}")
-                db.session.rollback()
-                return jsonify({"status": "ERROR", "error": "Failed to update model URL"}), 500
-        else:
-            app.logger.info(f"Model {model.id} not found in GCS at {model_filename}")
-    except Exception as e:
-        app.logger.error(f"Error checking GCS for model {model.id}: {str(e)}")
-        return jsonify({"status": "ERROR", "error": "Failed to check GCS: " + str(e)}), 500
-
-    # Step 3: If not in GCS, check Tripo API
-    if not model.task_id:
-        app.logger.error(f"No task_id for model {model.id}")
-        return jsonify({"status": "ERROR", "error": "No task ID available"}), 500
+@app.route('/api/status', methods=['GET'])
+@login_required
+def api_status():
+    # Statuses for many models in one query: /api/status?ids=1,2,3
+    ids = parse_ids(request.args.get('ids', ''))
+    user_models = Model.query.filter(Model.id.in_(ids), Model.user_id == current_user.id).all() if ids else []
+    return jsonify({'success': True, 'statuses': {m.id: status_payload(m) for m in user_models}})
 
-    try:
-        app.logger.info(f"Checking Tripo API for task_id: {model.task_id}")
-        task_response = requests.get(f"https://api.tripo3d.ai/v2/openapi/task/{model.task_id}", headers=HEADERS, timeout=15)
-        task_response.raise_for_status()
-        task_status = task_response.json()
-        status = task_status["data"]["status"]
-        progress = task_status["data"].get("progress", 0)
-        app.logger.info(f"Task {model.task_id} status: {status}, Progress: {progress}%, Response: {task_status}")
-
-        if status == "success":
-            result = task_status["data"].get("result")
-            if result:
-                glb_url = (result.get("model", {}).get("url") or 
-                          result.get("pbr_model", {}).get("url"))
-                if glb_url:
-                    glb_response = requests.get(glb_url, timeout=15)
-                    glb_response.raise_for_status()
-                    model_content = glb_response.content
-                    model_blob.upload_from_string(model_content, content_type='model/gltf-binary')
-                    model.model_url = f"https://storage.googleapis.com/{os.environ['BUCKET_NAME']}/{model_filename}"
-                    db.session.commit()
-                    app.logger.info(f"Model {model.id} uploaded to {model.model_url}")
-                    return jsonify({"status": "SUCCEEDED", "model_url": model.model_url})
-                else:
-                    app.logger.error(f"Task succeeded but no valid model URL in response: {task_status}")
-                    return jsonify({"status": "FAILED", "error": "No GLB URL in response"})
-            else:
-                app.logger.error(f"Task succeeded but no 'result' in response: {task_status}")
-                return jsonify({"status": "FAILED", "error": "No result in response"})
-        elif status == "running":
-            return jsonify({"status": "IN_PROGRESS", "progress": progress})
-        else:
-            failure_reason = task_status["data"].get("message", "No failure reason provided")
-            app.logger.error(f"Task failed or canceled: {status}, Reason: {failure_reason}")
-            return jsonify({"status": status, "error": failure_reason})
-    except requests.RequestException as e:
-        app.logger.error(f"Status check error: {str(e)}, Task ID: {model.task_id}")
-        if model_blob.exists():
-            app.logger.info(f"Model {model.id} found in GCS after Tripo error at {model_filename}")
-            try:
-                model.model_url = f"https://storage.googleapis.com/{os.environ['BUCKET_NAME']}/{model_filename}"
-                db.session.commit()
-                app.logger.info(f"Updated model {model.id} with model_url: {model.model_url}")
-                return jsonify({"status": "SUCCEEDED", "model_url": model.model_url})
-            except Exception as e:
-                app.logger.error(f"Failed to update model_url for model {model.id}: {str(e)}")
-                db.session.rollback()
-                return jsonify({"status": "ERROR", "error": "Failed to update model URL after Tripo error"}), 500
-        return jsonify({"status": "ERROR", "error": "Tripo API error: " + str(e)}), 500
-    except Exception as e:
-        app.logger.error(f"Unexpected error in status: {str(e)}, Task ID: {model.task_id}")
-        return jsonify({"status": "ERROR", "error": "Unexpected error: " + str(e)}), 500
+@app.route('/api/status/stream', methods=['GET'])
+@login_required
+def api_status_stream():
+    """Server-Sent Events: one `status` event per change for the current user's
+    unfinished models, then `done` once all of them are finished. The stream
+    closes after STATUS_STREAM_SECONDS and EventSource reconnects. With
+    STATUS_STREAM_MAX streams already open in this process it answers 503
+    and the page falls back to polling /api/status."""
+    user_id = current_user.id
+    query = Model.query.filter(Model.user_id == user_id)
+    if request.args.get('ids'):
+        query = query.filter(Model.id.in_(parse_ids(request.args['ids'])))
+    else:
+        query = query.filter(Model.model_url.is_(None),
+                             or_(Model.status.is_(None), Model.status.in_([STATUS_QUEUED, STATUS_RUNNING])))
+    ids = [m.id for m in query.with_entities(Model.id)]
+    db.session.close()
+    if not open_streams.acquire():
+        # EventSource gives up on a non-200 response; the page then polls /api/status
+        response = jsonify({'success': False, 'message': 'Too many open status streams, poll /api/status'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+
+    def events():
+        last = {}
+        pending = set(ids)
+        deadline = time.monotonic() + app.config['STATUS_STREAM_SECONDS']
+        yield f"retry: {int(app.config['STATUS_STREAM_INTERVAL'] * 1000)}\n\n"
+        while pending and time.monotonic() < deadline:
+            for model in Model.query.filter(Model.id.in_(pending), Model.user_id == user_id):
+                payload = dict(status_payload(model), id=model.id)
+                if last.get(model.id) != payload:
+                    last[model.id] = payload
+                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+                if payload["status"] != "IN_PROGRESS":
+                    pending.discard(model.id)
+            # Don't hold a DB connection while waiting
+            db.session.close()
+            if pending:
+                time.sleep(app.config['STATUS_STREAM_INTERVAL'])
+        if not pending:
+            yield "event: done\ndata: {}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server is done with the response, even if the client left early
+    response.call_on_close(open_streams.release)
+    return response
+
+class StreamSlots:
+    """Counts open /api/status/stream responses in this process."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.count >= self.limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.count -= 1
+
+open_streams = StreamSlots(app.config['STATUS_STREAM_MAX'])
 
 @app.route('/delete_model/<int:model_id>', methods=['POST'])
 @login_required
@@ -326,30 +504,92 @@ def delete_model(model_id):
     model = Model.query.get_or_404(model_id)
     if model.user_id != current_user.id:
         abort(403)
-    # Remove model file from GCS if exists
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(os.environ['BUCKET_NAME'])
-        # Remove image
-        if model.image_url:
-            image_path = '/'.join(model.image_url.split('/')[-3:])
-            image_blob = bucket.blob(image_path)
-            if image_blob.exists():
-                image_blob.delete()
-        # Remove model file
-        if model.model_url:
-            model_path = '/'.join(model.model_url.split('/')[-3:])
-            model_blob = bucket.blob(model_path)
-            if model_blob.exists():
-                model_blob.delete()
-    except Exception as e:
-        app.logger.error(f"Error deleting files from GCS: {str(e)}")
-    # Remove from DB
-    db.session.delete(model)
-    db.session.commit()
+    delete_models([model])
     flash('Model deleted successfully.')
     return redirect(url_for('models'))
 
+def delete_models(models):
+    """Delete model rows and their storage objects. Returns how many objects
+    are left for the worker's delete_blobs job to retry.
+
+    The rows go in one transaction together with a BlobDeletion row per
+    object, so an object is never orphaned without a record of it; the
+    objects are then deleted in batches and their records dropped. The
+    models' jobs go too: their keys (submit:<id>, ...) would otherwise block
+    the jobs of a later model that gets the same id.
+    """
+    store = get_storage()
+    names = []
+    for model in models:
+        for url in (model.image_url, model.model_url, model.model_gz_url, model.thumbnail_url):
+            if url:
+                names.append(store.name_from_url(url))
+        db.session.delete(model)
+    if models:
+        Job.query.filter(Job.model_id.in_([model.id for model in models])).delete(synchronize_session=False)
+    deletions = [BlobDeletion(name=name) for name in names]
+    db.session.add_all(deletions)
+    db.session.commit()
+    if not names:
+        return 0
+
+    try:
+        failed = set(store.delete_many(names))
+    except Exception as e:
+        app.logger.error(f"Error deleting files from storage: {str(e)}")
+        failed = set(names)
+    done_ids = [d.id for d in deletions if d.name not in failed]
+    if done_ids:
+        BlobDeletion.query.filter(BlobDeletion.id.in_(done_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    if failed:
+        app.logger.error(f"{len(failed)} storage objects not deleted, queued for retry")
+        worker.schedule_blob_deletion(delay=30)
+    return len(failed)
+
+BULK_DELETE_MAX = 1000
+
+def bulk_delete_response(query):
+    """Delete the models of `query` whose ids are in the JSON body's "ids"."""
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({'success': False, 'message': 'ids must be a list of integers'}), 400
+    if len(ids) > BULK_DELETE_MAX:
+        return jsonify({'success': False, 'message': f'At most {BULK_DELETE_MAX} ids per request'}), 400
+    models = query.filter(Model.id.in_(ids)).all() if ids else []
+    deleted = sorted(m.id for m in models)
+    pending = delete_models(models)
+    app.logger.info(f"Bulk deleted {len(deleted)} models for user {current_user.id}")
+    return jsonify({'success': True, 'deleted': deleted,
+                    'not_found': sorted(set(ids) - set(deleted)),
+                    'pending_blobs': pending})
+
+@app.route('/api/models/delete', methods=['POST'])
+@login_required
+def api_delete_models():
+    # {"ids": [...]}; ids the user doesn't own are reported as not_found
+    return bulk_delete_response(Model.query.filter_by(user_id=current_user.id))
+
+@app.route('/api/admin/models/delete', methods=['POST'])
+@login_required
+def api_admin_delete_models():
+    if not current_user.is_admin:
+        abort(403)
+    return bulk_delete_response(Model.query)
+
+@app.route('/admin_delete_models', methods=['POST'])
+@login_required
+def admin_delete_models():
+    # "Delete selected" on the admin panel
+    if not current_user.is_admin:
+        abort(403)
+    ids = request.form.getlist('ids', type=int)[:BULK_DELETE_MAX]
+    models = Model.query.filter(Model.id.in_(ids)).all() if ids else []
+    delete_models(models)
+    flash(f'Deleted {len(models)} models.')
+    return redirect(url_for('admin_panel'))
+
 @app.route('/rename_model/<int:model_id>', methods=['POST'])
 @login_required
 def rename_model(model_id):
@@ -382,36 +622,90 @@ def admin_delete_model(model_id):
     if not current_user.is_admin:
         abort(403)
     model = Model.query.get_or_404(model_id)
-    # Remove model file from GCS if exists
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(os.environ['BUCKET_NAME'])
-        # Remove image
-        if model.image_url:
-            image_path = '/'.join(model.image_url.split('/')[-3:])
-            image_blob = bucket.blob(image_path)
-            if image_blob.exists():
-                image_blob.delete()
-        # Remove model file
-        if model.model_url:
-            model_path = '/'.join(model.model_url.split('/')[-3:])
-            model_blob = bucket.blob(model_path)
-            if model_blob.exists():
-                model_blob.delete()
-    except Exception as e:
-        app.logger.error(f"Error deleting files from GCS: {str(e)}")
-    # Remove from DB
-    db.session.delete(model)
-    db.session.commit()
+    delete_models([model])
     flash('Model deleted successfully.')
     return redirect(url_for('admin_panel'))
 
+@app.route('/models/<int:model_id>/file')
+@login_required
+def model_file(model_id):
+    """The model's GLB with Range, ETag/conditional GET and gzip support.
+
+    Sends the precompressed variant when the client accepts gzip (or asks
+    for ?encoding=gzip) and isn't requesting a byte range.
+    """
+    model = Model.query.get_or_404(model_id)
+    if model.user_id != current_user.id and not current_user.is_admin:
+        abort(403)
+    if not model.model_url:
+        abort(404)
+    store = get_storage()
+    name = store.name_from_url(model.model_url)
+    # Content-addressed names (worker.glb_object_name) make the name a strong validator
+    etag = hashlib.sha256(name.encode()).hexdigest()[:32]
+
+    wants_gzip = request.args.get('encoding') == 'gzip' or 'gzip' in request.accept_encodings
+    encoding = None
+    if model.model_gz_url and wants_gzip and not request.range:
+        name, etag, encoding = store.name_from_url(model.model_gz_url), etag + '-gz', 'gzip'
+
+    # Revalidations are answered from the name alone, without a storage round trip
+    if request.if_none_match.contains_weak(etag):
+        return model_file_headers(Response(status=304, mimetype='model/gltf-binary'), etag, encoding)
+
+    size = store.size(name)
+    if size is None:
+        abort(404)
+    reader = store.open_reader(name, chunk_size=worker.DEFAULT_CHUNK_SIZE)
+    response = Response(wrap_file(request.environ, reader, worker.READ_SIZE), mimetype='model/gltf-binary',
+                        direct_passthrough=True)
+    response.content_length = size
+    model_file_headers(response, etag, encoding)
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+def model_file_headers(response, etag, encoding):
+    response.set_etag(etag)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+MODELS_PAGE_SIZE = 24
+
 @app.route('/models', methods=['GET'])
 @login_required
 def models():
-    user_models = Model.query.filter_by(user_id=current_user.id).order_by(Model.created_at.desc()).all()
+    # Served by ix_model_user_id_created_at
+    try:
+        user_models, next_cursor = keyset_page(Model.query.filter_by(user_id=current_user.id),
+                                               Model.created_at, Model.id, cursor=request.args.get('after'),
+                                               limit=MODELS_PAGE_SIZE, is_datetime=True)
+    except ValueError:
+        abort(400)
     app.logger.info(f"Found {len(user_models)} models for user {current_user.id}")
-    return render_template('models.html', models=user_models)
+    return render_template('models.html', models=user_models, next_cursor=next_cursor,
+                           paged=bool(request.args.get('after')))
+
+ADMIN_PAGE_SIZE = 50
+
+# Sortable admin columns; nullable ones are coalesced so keyset comparisons work
+ADMIN_SORTS = {
+    'created_at': Model.created_at,
+    'id': Model.id,
+    'name': func.coalesce(Model.name, ''),
+    'user': func.coalesce(User.username, ''),
+    'status': func.coalesce(Model.status, ''),
+}
+
+def filter_by_status(query, status):
+    if status == STATUS_SUCCEEDED:
+        return query.filter(Model.model_url.isnot(None))
+    if status == STATUS_RUNNING:
+        return query.filter(Model.model_url.is_(None), or_(Model.status.is_(None), Model.status == STATUS_RUNNING))
+    if status in (STATUS_QUEUED, STATUS_FAILED):
+        return query.filter(Model.model_url.is_(None), Model.status == status)
+    return query
 
 @app.route('/admin_panel')
 @login_required
@@ -419,21 +713,43 @@ def admin_panel():
     if not current_user.is_admin:
         flash('Access denied. Admins only.')
         return redirect(url_for('index'))
-    users = User.query.all()
-    models = Model.query.all()
-    model_details = [
-        {
-            'id': model.id,
-            'user_id': model.user_id,
-            'username': User.query.get(model.user_id).username if User.query.get(model.user_id) else 'Deleted User',
-            'image_url': model.image_url,
-            'model_url': model.model_url,
-            'task_id': model.task_id,
-            'name': model.name
-        }
-        for model in models
-    ]
-    return render_template('admin_panel.html', users=users, models=model_details)
+
+    # Totals and per-user counts computed in SQL
+    total, completed, failed = db.session.query(
+        func.count(Model.id),
+        func.count(Model.model_url),
+        func.coalesce(func.sum(case((and_(Model.model_url.is_(None), Model.status == STATUS_FAILED), 1), else_=0)), 0),
+    ).one()
+    users = (db.session.query(User, func.count(Model.id).label('model_count'))
+             .outerjoin(Model, Model.user_id == User.id)
+             .group_by(User.id).order_by(User.id).all())
+    stats = {'users': len(users), 'models': total, 'completed': completed, 'failed': failed,
+             'processing': total - completed - failed}
+
+    # One page of models with their owner, filtered and sorted server-side
+    filters = {
+        'user': request.args.get('user', '').strip(),
+        'name': request.args.get('name', '').strip(),
+        'status': request.args.get('status', ''),
+        'sort': request.args.get('sort', 'created_at'),
+        'dir': 'asc' if request.args.get('dir') == 'asc' else 'desc',
+    }
+    if filters['sort'] not in ADMIN_SORTS:
+        filters['sort'] = 'created_at'
+    query = Model.query.outerjoin(Model.user).options(contains_eager(Model.user))
+    if filters['user']:
+        query = query.filter(User.username == filters['user'])
+    if filters['name']:
+        query = query.filter(Model.name.ilike(f"%{filters['name']}%"))
+    query = filter_by_status(query, filters['status'])
+    try:
+        page, next_cursor = keyset_page(query, ADMIN_SORTS[filters['sort']], Model.id,
+                                        cursor=request.args.get('after'), descending=filters['dir'] == 'desc',
+                                        limit=ADMIN_PAGE_SIZE, is_datetime=filters['sort'] == 'created_at')
+    except ValueError:
+        abort(400)
+    return render_template('admin_panel.html', users=users, models=page, stats=stats,
+                           filters=filters, next_cursor=next_cursor, paged=bool(request.args.get('after')))
 
 # API for Unity
 @app.route('/api/login', methods=['POST'])
@@ -441,10 +757,13 @@ def api_login():
     data = request.get_json()
     username = data.get('username')
     password = data.get('password')
-    user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    user = authenticate(username, password)
+    if user:
         login_user(user)
-        return jsonify({'success': True, 'user_id': user.id, 'is_admin': user.is_admin})
+        # Send as "Authorization: Bearer <token>" to skip the session lookup on /api/*
+        return jsonify({'success': True, 'user_id': user.id, 'is_admin': user.is_admin,
+                        'token': auth.issue_token(user, app.config['SECRET_KEY']),
+                        'token_expires_in': app.config['API_TOKEN_MAX_AGE']})
     return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
 
 @app.route('/api/signup', methods=['POST'])
@@ -455,32 +774,131 @@ def api_signup():
     if User.query.filter_by(username=username).first():
         return jsonify({'success': False, 'message': 'Username already exists'}), 400
     user = User(username=username)
-    user.set_password(password)
+    user.set_password(password, app.config['PASSWORD_HASH_METHOD'])
     db.session.add(user)
     db.session.commit()
     login_user(user)
     return jsonify({'success': True, 'user_id': user.id, 'is_admin': user.is_admin})
 
+API_MODELS_MAX_LIMIT = 200
+
 @app.route('/api/models', methods=['GET'])
 @login_required
 def api_get_models():
-    models = Model.query.filter_by(user_id=current_user.id).all()
-    model_list = [{'id': m.id, 'image_url': m.image_url, 'model_url': m.model_url} for m in models]
-    return jsonify({'success': True, 'models': model_list})
-
-# Initialize database
+    """Newest first. ?limit=N pages the list; pass the returned next_cursor as
+    ?cursor= for the next page. Without limit every model is returned, as
+    older Unity builds expect. Responses carry an ETag, so a client polling
+    an unchanged list gets a 304 without the server loading any rows."""
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, API_MODELS_MAX_LIMIT))
+
+    # Any insert, delete or update of the user's models changes one of these
+    count, last_id, last_change = db.session.query(
+        func.count(Model.id), func.max(Model.id), func.max(func.coalesce(Model.updated_at, Model.created_at)),
+    ).filter(Model.user_id == current_user.id).one()
+    etag = hashlib.sha1(f"{current_user.id}:{count}:{last_id}:{last_change}:{cursor}:{limit}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        query = Model.query.filter_by(user_id=current_user.id)
+        next_cursor = None
+        try:
+            if limit is None:
+                models = query.order_by(Model.created_at.desc(), Model.id.desc()).all()
+            else:
+                models, next_cursor = keyset_page(query, Model.created_at, Model.id, cursor=cursor,
+                                                  limit=limit, is_datetime=True)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        model_list = [{'id': m.id, 'image_url': m.image_url, 'model_url': m.model_url} for m in models]
+        response = jsonify({'success': True, 'models': model_list, 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/tripo/webhook', methods=['POST'])
+def tripo_webhook():
+    """Task notifications from Tripo (see tripo.verify_webhook). Anything
+    correctly signed gets a 200, even for tasks we don't know, so Tripo
+    doesn't keep redelivering it."""
+    secret = app.config['TRIPO_WEBHOOK_SECRET']
+    if not secret:
+        abort(404)
+    body = request.get_data(cache=False)
+    if not tripo.verify_webhook(body, request.headers.get('X-Tripo-Timestamp'),
+                                request.headers.get('X-Tripo-Signature'), secret):
+        metrics.WEBHOOKS_TOTAL.labels('bad_signature').inc()
+        return jsonify({'success': False, 'message': 'Invalid signature'}), 401
+    try:
+        event = tripo.parse_webhook(json.loads(body))
+    except ValueError:
+        event = None
+    if event is None:
+        metrics.WEBHOOKS_TOTAL.labels('bad_payload').inc()
+        return jsonify({'success': False, 'message': 'Invalid payload'}), 400
+    task_id, status, progress = event
+    models = worker.record_task_event(task_id, status, progress)
+    metrics.WEBHOOKS_TOTAL.labels('accepted' if models else 'unknown_task').inc()
+    app.logger.info(f"Tripo webhook: task {task_id} {status} {progress}% ({models} models)")
+    return jsonify({'success': True, 'models': models})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    body, content_type = metrics.render(app)
+    return Response(body, content_type=content_type)
+
+# Schema and admin setup run from the CLI, once per deploy, not on import:
+#
+#     flask --app app init-db     create tables, migrate, ensure the admin user
+#     flask --app app migrate     create tables and migrate only
+#
+# Importing this module touches neither the database nor the cloud SDKs, so
+# gunicorn workers (or a preloading master) start without any I/O.
 with app.app_context():
+    metrics.instrument_engine(db.engine)
+
+def migrate_db():
     db.create_all()
+    migrations.upgrade(db.engine)
+
+def ensure_admin():
     admin = User.query.filter_by(username='admin').first()
     if not admin:
         admin = User(username='admin', is_admin=True)
-        admin.set_password('admin123')
+        admin.set_password('admin123', app.config['PASSWORD_HASH_METHOD'])
         db.session.add(admin)
     else:
         admin.is_admin = True
-        admin.set_password('admin123')
+        admin.set_password('admin123', app.config['PASSWORD_HASH_METHOD'])
     db.session.commit()
     app.logger.info("Admin user 'admin' ensured with password 'admin123'")
 
+@app.cli.command('migrate')
+def migrate_command():
+    """Create missing tables and apply schema migrations."""
+    migrate_db()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Migrate, then create or reset the admin user."""
+    migrate_db()
+    ensure_admin()
+
+def start_background_worker():
+    """Start the in-process job worker if RUN_WORKER is set. Called per
+    serving process (gunicorn's post_worker_init), never at import: a thread
+    started in a preloading master would not survive the fork."""
+    if app.config['RUN_WORKER']:
+        return worker.start_worker(app)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
\ No newline at end of file
+    with app.app_context():
+        migrate_db()
+        ensure_admin()
+    start_background_worker()
+    app.run(host='0.0.0.0', port=8080)
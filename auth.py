@@ -0,0 +1,104 @@
+"""Authentication hot paths: the cached user loader, password hash settings
+and signed API tokens.
+
+Flask-Login loads the user on every authenticated request (every status
+poll from every tab), so UserCache keeps a per-process snapshot of each
+user for USER_CACHE_TTL seconds; any ORM change to a User row drops its
+entry in this process. Other processes see the change when their entry
+expires.
+
+/api/* requests may send "Authorization: Bearer <token>" (from /api/login)
+instead of the session cookie. Tokens are verified with SECRET_KEY alone,
+no session or database read, so they stay valid until they expire
+(API_TOKEN_MAX_AGE) even if the user is deleted or demoted.
+"""
+import threading
+import time
+
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+from models import db, User
+
+TOKEN_SALT = 'api-token'
+
+
+class UserCache:
+    def __init__(self, ttl=60, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+        event.listen(User, 'after_update', self._on_change)
+        event.listen(User, 'after_delete', self._on_change)
+
+    def get(self, user_id):
+        """The User with this id, attached to the current session; only
+        queries the database on a cache miss."""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            user = User(**entry[1])
+            # Attach as a persistent row without a SELECT
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        user = db.session.get(User, user_id)
+        if user is not None and self.ttl > 0:
+            values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+            with self._lock:
+                if len(self._entries) >= self.maxsize:
+                    self._entries.clear()
+                self._entries[user_id] = (time.monotonic() + self.ttl, values)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _on_change(self, mapper, connection, target):
+        self.invalidate(target.id)
+
+
+class TokenUser(UserMixin):
+    """current_user for token-authenticated API requests. Carries only what
+    the token says; routes that need more must load the User."""
+
+    def __init__(self, user_id, is_admin):
+        self.id = user_id
+        self.is_admin = is_admin
+
+
+def issue_token(user, secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps({'uid': user.id, 'adm': bool(user.is_admin)})
+
+def load_token(token, secret_key, max_age):
+    """The TokenUser for a valid, unexpired token, else None."""
+    try:
+        claims = URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+    return TokenUser(claims['uid'], claims['adm'])
+
+
+def canonical_hash_method(method):
+    """werkzeug fills in defaults for a partial method ("scrypt" becomes
+    "scrypt:32768:8:1"); return the full form stored in hashes so it can
+    be compared with User.password_hash. Mirrors werkzeug's defaults rather
+    than hashing a dummy password, which would cost a full scrypt at import."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        if not args:
+            return 'scrypt:32768:8:1'
+        if len(args) != 3:
+            raise ValueError("'scrypt' takes 3 arguments.")
+        n, r, p = map(int, args)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' takes 2 arguments.")
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Invalid hash method '{method}'.")
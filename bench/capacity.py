@@ -0,0 +1,161 @@
+"""Concurrent-request capacity of one app process, per SERVER_MODE.
+
+    python bench/capacity.py --modes threads gevent --streams 50 --clients 20 --seconds 10
+
+For each mode this starts gunicorn (one worker, gunicorn.conf.py) against a
+throwaway SQLite database and in-memory storage, with the job worker off
+so models stay in progress. It then:
+
+  1. opens --streams /api/status/stream connections and holds them open,
+  2. meanwhile runs --clients concurrent pollers of /api/status for
+     --seconds,
+
+and prints, as JSON per mode, how many streams got their first event (or
+were refused with 503 over STATUS_STREAM_MAX) and the pollers'
+throughput, latency percentiles and errors.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from stats import ms, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Smallest thing the upload endpoint accepts as an image; no worker ever decodes it
+FAKE_PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, db_path, stream_seconds):
+    env = dict(os.environ,
+               SERVER_MODE=mode, PORT=str(port), DATABASE_URL=f'sqlite:///{db_path}',
+               STORAGE_BACKEND='memory', RUN_WORKER='0', TRIPO_API_KEY='bench',
+               STATUS_STREAM_SECONDS=str(stream_seconds), STATUS_STREAM_INTERVAL='1',
+               PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(base + '/', timeout=1)
+            return proc, base
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({mode}) did not start")
+
+
+def seed(base):
+    """A user with one queued model; returns (auth headers, model id)."""
+    requests.post(base + '/api/signup', json={'username': 'bench', 'password': 'bench'}, timeout=10)
+    token = requests.post(base + '/api/login', json={'username': 'bench', 'password': 'bench'},
+                          timeout=10).json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    r = requests.post(base + '/api/upload', headers=headers, files={'image': ('bench.png', FAKE_PNG)}, timeout=10)
+    return headers, r.json()['model_id']
+
+
+def hold_stream(base, headers, model_id, stop, results):
+    started = time.monotonic()
+    try:
+        with requests.get(f'{base}/api/status/stream?ids={model_id}', headers=headers,
+                          stream=True, timeout=(5, 30)) as r:
+            if r.status_code == 503:
+                # Over STATUS_STREAM_MAX; the page would poll instead
+                results['refused'] = True
+                return
+            for line in r.iter_lines():
+                if line.startswith(b'event: status') and 'first_event' not in results:
+                    results['first_event'] = time.monotonic() - started
+                if stop.is_set():
+                    break
+    except requests.RequestException as e:
+        results['error'] = type(e).__name__
+
+
+def poll(base, headers, model_id, stop, latencies, errors):
+    session = requests.Session()
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            session.get(f'{base}/api/status?ids={model_id}', headers=headers, timeout=5).raise_for_status()
+            latencies.append(time.monotonic() - started)
+        except requests.RequestException:
+            errors.append(1)
+
+
+def run_mode(mode, streams, clients, seconds):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, base = start_server(mode, port, os.path.join(tmp, 'bench.db'), seconds + 30)
+        try:
+            headers, model_id = seed(base)
+            stop = threading.Event()
+            stream_results = [{} for _ in range(streams)]
+            threads = [threading.Thread(target=hold_stream, args=(base, headers, model_id, stop, res), daemon=True)
+                       for res in stream_results]
+            for t in threads:
+                t.start()
+            time.sleep(1)
+
+            latencies, errors = [], []
+            pollers = [threading.Thread(target=poll, args=(base, headers, model_id, stop, latencies, errors),
+                                        daemon=True) for _ in range(clients)]
+            started = time.monotonic()
+            for t in pollers:
+                t.start()
+            time.sleep(seconds)
+            stop.set()
+            for t in pollers:
+                t.join(10)
+            elapsed = time.monotonic() - started
+
+            first_events = [r['first_event'] for r in stream_results if 'first_event' in r]
+            return {
+                'streams_opened': streams,
+                'streams_served': len(first_events),
+                'streams_refused': sum(1 for r in stream_results if r.get('refused')),
+                'stream_first_event_p50_ms': ms(percentile(first_events, 50)),
+                'stream_first_event_max_ms': ms(max(first_events) if first_events else None),
+                'poll_requests': len(latencies),
+                'poll_rps': round(len(latencies) / elapsed, 1),
+                'poll_p50_ms': ms(percentile(latencies, 50)),
+                'poll_p95_ms': ms(percentile(latencies, 95)),
+                'poll_p99_ms': ms(percentile(latencies, 99)),
+                'poll_errors': len(errors),
+            }
+        finally:
+            # SIGINT is gunicorn's quick shutdown; SIGTERM would wait for the open streams
+            proc.send_signal(signal.SIGINT)
+            proc.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', nargs='+', default=['threads', 'gevent'])
+    parser.add_argument('--streams', type=int, default=50, help='SSE connections held open')
+    parser.add_argument('--clients', type=int, default=20, help='concurrent /api/status pollers')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    report = {mode: run_mode(mode, args.streams, args.clients, args.seconds) for mode in args.modes}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Cold-start cost: how long a new instance takes before it can serve.
+
+    python bench/coldstart.py --repeat 5 --workers 2
+
+Against a throwaway SQLite database and in-memory storage, prints as JSON:
+
+  import       `import app` in a fresh interpreter (--repeat runs), plus
+               the slowest modules app.py imports directly (-X importtime)
+  init_db      one `flask --app app init-db`, what a deploy runs once
+  gunicorn     per GUNICORN_PRELOAD setting: time from launching gunicorn
+               (gunicorn.conf.py, threads mode) to the first 200 from
+               /login, and the latency of the first request that hits the
+               database (POST /api/login, which checks an admin password
+               hashed with --hash-method)
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from capacity import free_port
+from stats import ms, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SNIPPET = 'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)'
+
+
+def bench_env(db_path, hash_method=None):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', STORAGE_BACKEND='memory', RUN_WORKER='0',
+               TRIPO_API_KEY='bench')
+    # Production's default (scrypt) unless asked otherwise, so any hashing on
+    # the startup path shows up in the numbers
+    env.pop('PASSWORD_HASH_METHOD', None)
+    if hash_method:
+        env['PASSWORD_HASH_METHOD'] = hash_method
+    return env
+
+
+def measure_import(env, repeat, top):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, env=env, check=True,
+                             capture_output=True, text=True).stdout
+        times.append(float(out.split()[-1]))
+    # Direct imports of app.py are indented by two spaces in -X importtime output
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|   (\S+)$', line)
+        if match:
+            modules.append((int(match.group(1)), match.group(2)))
+    return {
+        'p50_ms': ms(percentile(times, 50)),
+        'max_ms': ms(max(times)),
+        'slowest_imports_ms': {name: round(us / 1000, 1) for us, name in sorted(modules, reverse=True)[:top]},
+    }
+
+
+def measure_gunicorn(env, preload, workers):
+    port = free_port()
+    env = dict(env, PORT=str(port), SERVER_MODE='threads', GUNICORN_WORKERS=str(workers),
+               GUNICORN_PRELOAD='1' if preload else '0')
+    base = f'http://127.0.0.1:{port}'
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if requests.get(base + '/login', timeout=5).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.monotonic() - started > 60:
+                raise RuntimeError("gunicorn did not start")
+            time.sleep(0.01)
+        first_response = time.monotonic() - started
+        login_started = time.monotonic()
+        requests.post(base + '/api/login', json={'username': 'admin', 'password': 'admin123'},
+                      timeout=10).raise_for_status()
+        return first_response, time.monotonic() - login_started
+    finally:
+        proc.send_signal(signal.SIGINT)
+        proc.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2, help='GUNICORN_WORKERS')
+    parser.add_argument('--top', type=int, default=10, help='slowest direct imports to list')
+    parser.add_argument('--hash-method', help='PASSWORD_HASH_METHOD (default: the app default, scrypt)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bench_env(os.path.join(tmp, 'bench.db'), args.hash_method)
+        report = {'password_hash_method': args.hash_method or 'default',
+                  'import': measure_import(env, args.repeat, args.top)}
+
+        started = time.monotonic()
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        report['init_db_ms'] = ms(time.monotonic() - started)
+
+        report['gunicorn'] = {}
+        for preload in (False, True):
+            runs = [measure_gunicorn(env, preload, args.workers) for _ in range(args.repeat)]
+            first_response = [r[0] for r in runs]
+            first_db = [r[1] for r in runs]
+            report['gunicorn']['preload' if preload else 'no_preload'] = {
+                'first_response_p50_ms': ms(percentile(first_response, 50)),
+                'first_response_max_ms': ms(max(first_response)),
+                'first_db_request_p50_ms': ms(percentile(first_db, 50)),
+                'first_db_request_max_ms': ms(max(first_db)),
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
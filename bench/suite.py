@@ -0,0 +1,392 @@
+"""Offline benchmark suite: the app in-process against FakeTripoServer and
+MemoryStorage, no network or cloud credentials needed.
+
+    python bench/suite.py                                  # every scenario, JSON on stdout
+    python bench/suite.py upload_burst api_models --output bench.json
+    python bench/suite.py admin_panel --models 50000 --database-url postgresql://...
+
+Scenarios, run in this order against one database:
+
+    upload_burst    --uploads images through /api/upload from --clients
+                    threads while the job worker runs, until every model
+                    has finished (fake Tripo: --tripo-latency, --tripo-steps,
+                    --fail-rate, --glb-size)
+    status_polling  --tabs clients polling /status/<id> for --seconds
+    admin_panel     /admin_panel first page, --pages keyset pages deep, and
+                    a status filter, over --models seeded rows
+    api_models      Unity /api/models: full list, cursor pages and ETag
+                    revalidation for a user with --user-models models
+
+Each scenario reports throughput, latency percentiles, SQL queries per
+request and the peak Python memory allocated while it ran (tracemalloc).
+Timings include tracemalloc overhead, so compare runs of the suite with each
+other rather than with production numbers.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from stats import latency_summary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ['upload_burst', 'status_polling', 'admin_panel', 'api_models']
+BENCH_PASSWORD = 'bench'
+
+
+class QueryCounter:
+    """SQL statements executed, counted per thread so each request is
+    charged only for its own queries."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Recorder:
+    """Collects latencies and query counts from any number of client threads."""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.latencies = []
+        self.queries = []
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def request(self, client, method, url, **kwargs):
+        before = self.counter.count()
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.queries.append(self.counter.count() - before)
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+        return response
+
+    def summary(self, elapsed):
+        result = latency_summary(self.latencies, elapsed)
+        result['queries_per_request'] = round(sum(self.queries) / len(self.queries), 2) if self.queries else None
+        result['max_queries'] = max(self.queries) if self.queries else None
+        result['status_codes'] = {str(code): n for code, n in sorted(self.statuses.items())}
+        return result
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_image(side):
+    from PIL import Image
+    image = Image.effect_noise((side, side * 3 // 4), 64).convert('RGB')
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.tmp = tempfile.mkdtemp(prefix='bench-')
+        from fakes import FakeTripoServer
+        self.tripo = FakeTripoServer(steps=args.tripo_steps, latency=args.tripo_latency,
+                                     fail_rate=args.fail_rate, glb_size=args.glb_size).start()
+        os.environ.update({
+            'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(self.tmp, 'bench.db')}",
+            'STORAGE_BACKEND': 'memory',
+            'RUN_WORKER': '0',
+            'TRIPO_API_KEY': 'bench',
+            'TRIPO_API_BASE': self.tripo.base_url,
+            'FINALIZE_POLL_INTERVAL': str(args.tripo_poll_interval),
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        })
+        import app as app_module
+        self.app = app_module.app
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.logger.setLevel('WARNING')
+        from models import db
+        with self.app.app_context():
+            app_module.migrate_db()
+            self.counter = QueryCounter(db.engine)
+        self.users = {}
+
+    def user(self, username, is_admin=False):
+        """Create (once) and return the id of a bench user."""
+        from models import db, User
+        if username not in self.users:
+            with self.app.app_context():
+                user = User.query.filter_by(username=username).first()
+                if user is None:
+                    user = User(username=username, is_admin=is_admin)
+                    user.set_password(BENCH_PASSWORD, self.app.config['PASSWORD_HASH_METHOD'])
+                    db.session.add(user)
+                    db.session.commit()
+                self.users[username] = user.id
+        return self.users[username]
+
+    def client(self, username):
+        client = self.app.test_client()
+        response = client.post('/api/login', json={'username': username, 'password': BENCH_PASSWORD})
+        assert response.status_code == 200, response.data
+        return client
+
+    def measure(self, scenario):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = getattr(self, scenario)()
+        result['wall_s'] = round(time.perf_counter() - started, 2)
+        result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+        return result
+
+    # Scenarios
+
+    def upload_burst(self):
+        import worker as worker_module
+        from models import Model, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED
+        args = self.args
+        self.user('uploader')
+        image = test_image(args.image_side)
+        recorder = Recorder(self.counter)
+        requests_before = len(self.tripo.requests)
+        job_worker = worker_module.Worker(self.app, concurrency=args.workers, poll_interval=0.05).start()
+        started = time.perf_counter()
+
+        def upload(i):
+            client = self.client('uploader')
+            for n in range(i, args.uploads, args.clients):
+                # Decoders ignore bytes after the JPEG end marker; they make every
+                # upload distinct so deduplication doesn't collapse the burst
+                data = image + f'bench-{time.time_ns()}-{n}'.encode()
+                recorder.request(client, 'POST', '/api/upload',
+                                 data={'image': (io.BytesIO(data), f'bench-{n}.jpg')},
+                                 content_type='multipart/form-data')
+        run_threads(args.clients, upload)
+        accepted = time.perf_counter() - started
+
+        deadline = time.monotonic() + args.timeout
+        with self.app.app_context():
+            user_models = Model.query.filter_by(user_id=self.users['uploader'])
+            while time.monotonic() < deadline:
+                unfinished = user_models.filter(Model.status.in_([STATUS_QUEUED, STATUS_RUNNING])).count()
+                if not unfinished:
+                    break
+                time.sleep(0.1)
+            succeeded = user_models.filter(Model.status == STATUS_SUCCEEDED).count()
+            failed = user_models.filter(Model.status == STATUS_FAILED).count()
+        completed = time.perf_counter() - started
+        job_worker.stop(timeout=5)
+
+        result = recorder.summary(accepted)
+        result.update({
+            'uploads': args.uploads,
+            'image_bytes': len(image),
+            'all_finished_s': round(completed, 2),
+            'models_per_s': round((succeeded + failed) / completed, 2),
+            'succeeded': succeeded,
+            'failed': failed,
+            'unfinished': args.uploads - succeeded - failed,
+            'tripo_requests': len(self.tripo.requests) - requests_before,
+        })
+        return result
+
+    def status_polling(self):
+        from models import Model
+        args = self.args
+        self.user('uploader')
+        with self.app.app_context():
+            ids = [m.id for m in Model.query.filter_by(user_id=self.users['uploader'])
+                   .with_entities(Model.id).limit(50)]
+        if not ids:
+            return {'skipped': 'no models; run upload_burst first'}
+        recorder = Recorder(self.counter)
+        stop = time.monotonic() + args.seconds
+
+        def tab(i):
+            client = self.client('uploader')
+            n = i
+            while time.monotonic() < stop:
+                recorder.request(client, 'GET', f'/status/{ids[n % len(ids)]}')
+                n += 1
+        started = time.perf_counter()
+        run_threads(args.tabs, tab)
+        result = recorder.summary(time.perf_counter() - started)
+        result['tabs'] = args.tabs
+        return result
+
+    def seed_models(self):
+        """Bulk-insert --models rows spread over 100 users, --user-models of
+        them belonging to the 'unity' user. Skipped if already there."""
+        from sqlalchemy import insert
+        from models import db, Model, STATUS_SUCCEEDED, STATUS_FAILED, STATUS_RUNNING
+        args = self.args
+        owners = [self.user(f'seed{i}') for i in range(100)]
+        unity = self.user('unity')
+        with self.app.app_context():
+            if Model.query.filter_by(user_id=unity).first() is not None:
+                return
+            now = datetime.datetime.utcnow()
+            rows = []
+            for n in range(args.models):
+                user_id = unity if n < args.user_models else owners[n % len(owners)]
+                status = (STATUS_SUCCEEDED, STATUS_SUCCEEDED, STATUS_SUCCEEDED, STATUS_FAILED, STATUS_RUNNING)[n % 5]
+                created = now - datetime.timedelta(minutes=n)
+                rows.append({
+                    'user_id': user_id, 'name': f'seed model {n}', 'status': status,
+                    'image_url': f'/storage/images/{user_id}/seed-{n}.jpg',
+                    'model_url': f'/storage/models/{user_id}/{n}-seed.glb' if status == STATUS_SUCCEEDED else None,
+                    'task_id': f'seed-task-{n}', 'progress': 100 if status == STATUS_SUCCEEDED else 40,
+                    'created_at': created, 'updated_at': created,
+                })
+                if len(rows) == 5000:
+                    db.session.execute(insert(Model), rows)
+                    rows = []
+            if rows:
+                db.session.execute(insert(Model), rows)
+            db.session.commit()
+
+    def admin_panel(self):
+        args = self.args
+        seed_started = time.perf_counter()
+        self.seed_models()
+        seeding = time.perf_counter() - seed_started
+        self.user('bench-admin', is_admin=True)
+        client = self.client('bench-admin')
+        recorder = Recorder(self.counter)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            recorder.request(client, 'GET', '/admin_panel')
+        deep = Recorder(self.counter)
+        url = '/admin_panel'
+        for _ in range(args.pages):
+            response = deep.request(client, 'GET', url)
+            match = re.search(r'href="(/admin_panel\?[^"]*after=[^"]+)"', response.get_data(as_text=True))
+            if not match:
+                break
+            url = match.group(1).replace('&amp;', '&')
+        filtered = Recorder(self.counter)
+        for _ in range(args.repeat):
+            filtered.request(client, 'GET', '/admin_panel?status=failed&sort=name&dir=asc')
+        elapsed = time.perf_counter() - started
+        combined = Recorder(self.counter)
+        for r in (recorder, deep, filtered):
+            combined.latencies += r.latencies
+            combined.queries += r.queries
+            for code, n in r.statuses.items():
+                combined.statuses[code] = combined.statuses.get(code, 0) + n
+        result = combined.summary(elapsed)
+        result.update({
+            'models': args.models,
+            'seed_s': round(seeding, 2),
+            'first_page': recorder.summary(None),
+            'deep_pages': dict(deep.summary(None), pages=len(deep.latencies)),
+            'status_filter': filtered.summary(None),
+        })
+        return result
+
+    def api_models(self):
+        args = self.args
+        self.seed_models()
+        client = self.client('unity')
+        full = Recorder(self.counter)
+        for _ in range(args.repeat):
+            response = full.request(client, 'GET', '/api/models')
+        etag = response.headers.get('ETag')
+        revalidate = Recorder(self.counter)
+        for _ in range(args.repeat):
+            revalidate.request(client, 'GET', '/api/models', headers={'If-None-Match': etag})
+        paged = Recorder(self.counter)
+        cursor = None
+        while True:
+            url = '/api/models?limit=100' + (f'&cursor={cursor}' if cursor else '')
+            cursor = paged.request(client, 'GET', url).get_json().get('next_cursor')
+            if not cursor:
+                break
+        return {
+            'user_models': args.user_models,
+            'full_list': dict(full.summary(None), bytes=len(response.data)),
+            'etag_revalidation': revalidate.summary(None),
+            'paged_100': dict(paged.summary(None), pages=len(paged.latencies)),
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--database-url', help='default: a throwaway SQLite file')
+    parser.add_argument('--uploads', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help='job worker threads')
+    parser.add_argument('--image-side', type=int, default=1600)
+    parser.add_argument('--timeout', type=float, default=120, help='max seconds to wait for uploads to finish')
+    parser.add_argument('--tabs', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--models', type=int, default=50000)
+    parser.add_argument('--user-models', type=int, default=2000)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--tripo-latency', type=float, default=0.05)
+    parser.add_argument('--tripo-steps', type=int, default=3)
+    parser.add_argument('--tripo-poll-interval', type=float, default=0.2)
+    parser.add_argument('--fail-rate', type=float, default=0.05)
+    parser.add_argument('--glb-size', type=int, default=2 * 1024 * 1024)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    args.scenarios = [s for s in SCENARIOS if s in args.scenarios] if args.scenarios else SCENARIOS
+
+    bench = Bench(args)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'database': bench.app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'settings': vars(args),
+        'scenarios': {},
+    }
+    for scenario in args.scenarios:
+        print(f"Running {scenario}...", file=sys.stderr)
+        report['scenarios'][scenario] = bench.measure(scenario)
+    bench.tripo.stop()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""A local stand-in for the Tripo API, for development and worker testing.
+
+    server = FakeTripoServer(steps=3).start()
+    app.config['TRIPO_API_BASE'] = server.base_url
+    worker = Worker(app, storage=MemoryStorage())
+
+MemoryStorage and LocalStorage (storage_backend.py) stand in for GCS; both
+record `peak_buffered`, the largest number of bytes a writer held in memory.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTripoServer:
+    """Speaks the subset of the Tripo v2 openapi used by the app.
+
+    A task reports `running` for `steps` status polls, advancing its progress,
+    then `success` (or `failed` if fail=True, or with probability fail_rate).
+    The GLB is served by the same server and is `glb_size` bytes long. The
+    first `throttle` API requests are answered with 429 and `Retry-After: 0`.
+    Every API request (not GLB downloads) waits `latency` seconds first.
+    """
+
+    def __init__(self, steps=2, fail=False, glb_size=1024, throttle=0, latency=0, fail_rate=0,
+                 host='127.0.0.1', port=0, seed=0):
+        self.steps = steps
+        self.fail = fail
+        self.glb_size = glb_size
+        self.throttle = throttle
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.outcomes = {}
+        self._random = random.Random(seed)
+        self.polls = {}
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v2/openapi'
+
+    def glb_bytes(self, task_id):
+        return (b'glTF' + task_id.encode()).ljust(self.glb_size, b'\0')
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _task_status(self, task_id):
+        with self._lock:
+            polls = self.polls.get(task_id, 0)
+            self.polls[task_id] = polls + 1
+        if polls < self.steps:
+            return {"task_id": task_id, "status": "running",
+                    "progress": int(100 * polls / max(self.steps, 1))}
+        with self._lock:
+            if task_id not in self.outcomes:
+                self.outcomes[task_id] = self.fail or self._random.random() < self.fail_rate
+            failed = self.outcomes[task_id]
+        if failed:
+            return {"task_id": task_id, "status": "failed", "message": "Simulated failure"}
+        host, port = self._httpd.server_address[:2]
+        return {"task_id": task_id, "status": "success", "progress": 100,
+                "result": {"model": {"type": "glb", "url": f"http://{host}:{port}/files/{task_id}.glb"}}}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, body, code=200):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _throttled(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    if fake.throttle <= 0:
+                        return False
+                    fake.throttle -= 1
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                fake.requests.append(('POST', self.path))
+                if self._throttled():
+                    return
+                if self.path.endswith('/upload'):
+                    return self._json({"code": 0, "data": {"image_token": f"token-{next(fake._ids)}"}})
+                if self.path.endswith('/task'):
+                    return self._json({"code": 0, "data": {"task_id": f"task-{next(fake._ids)}"}})
+                self._json({"code": 404, "message": "Not found"}, 404)
+
+            def do_GET(self):
+                fake.requests.append(('GET', self.path))
+                if '/task/' in self.path:
+                    if self._throttled():
+                        return
+                    task_id = self.path.rsplit('/', 1)[-1]
+                    return self._json({"code": 0, "data": fake._task_status(task_id)})
+                if self.path.startswith('/files/'):
+                    body = fake.glb_bytes(self.path.rsplit('/', 1)[-1][:-len('.glb')])
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'model/gltf-binary')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    for i in range(0, len(body), 64 * 1024):
+                        self.wfile.write(body[i:i + 64 * 1024])
+                    return
+                self._json({"code": 404, "message": "Not found"}, 404)
+
+        return Handler
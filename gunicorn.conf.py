@@ -0,0 +1,79 @@
+"""gunicorn settings (the Dockerfile runs `gunicorn -c gunicorn.conf.py app:app`).
+
+SERVER_MODE picks how a worker process waits on I/O:
+
+    threads  gthread workers with GUNICORN_THREADS threads each (default).
+             Concurrent requests per process = threads, and every open
+             /api/status/stream holds one of them, so only
+             STATUS_STREAM_MAX (a quarter of the threads) may stream;
+             pages over the limit poll /api/status instead.
+    gevent   One greenlet per connection, up to GUNICORN_CONNECTIONS. The
+             stdlib, requests/GCS sockets and psycopg2 (via psycogreen) are
+             made cooperative, so waiting on the database, storage or an SSE
+             interval costs a greenlet rather than a thread. Run the job
+             worker as its own process (RUN_WORKER=0 here, `python worker.py`
+             there) so Pillow and GLB transfers don't share the hub.
+
+bench/capacity.py measures both modes.
+
+In threads mode the app is imported once in the master (GUNICORN_PRELOAD,
+default on) and workers fork from it, so each worker skips the imports
+and only the master pays them, along with the GCS SDK. gevent mode doesn't
+preload: its workers must monkey-patch before ssl and requests are imported.
+Importing app.py does no database work; run `flask --app app init-db` once
+per deploy, or set MIGRATE_ON_START=1 to run `flask --app app migrate` at
+boot before any worker starts. bench/coldstart.py measures startup.
+
+With more than one worker, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory so /metrics aggregates every worker (see metrics.py).
+"""
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+server_mode = os.environ.get('SERVER_MODE', 'threads')
+if server_mode == 'threads':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+elif server_mode == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 1000))
+else:
+    raise ValueError(f"Unknown SERVER_MODE: {server_mode}")
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1' if server_mode == 'threads' else '0') == '1'
+
+
+def on_starting(server):
+    if os.environ.get('MIGRATE_ON_START') == '1':
+        # A separate process, so a gevent master never imports the app unpatched
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], check=True)
+
+
+def when_ready(server):
+    # Runs in the master before the first fork; with preload the workers
+    # inherit the SDK instead of each importing it on its first upload
+    if preload_app and os.environ.get('STORAGE_BACKEND', 'gcs') == 'gcs':
+        import google.cloud.storage  # noqa: F401
+
+
+def post_worker_init(worker):
+    if server_mode == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            pass
+        else:
+            # Let other greenlets run while psycopg2 waits on Postgres
+            patch_psycopg()
+    from app import start_background_worker
+    start_background_worker()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
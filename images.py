@@ -0,0 +1,129 @@
+"""Image sniffing, normalization and thumbnails.
+
+sniff_format() is cheap and runs in the request. prepare() decodes and
+re-encodes the image, which is CPU-heavy, so the worker runs it in a
+process pool (see prepare_in_pool) rather than on a request or worker
+thread.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# (magic bytes prefix, offset, format)
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 0, 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'png'),
+    (b'GIF87a', 0, 'gif'),
+    (b'GIF89a', 0, 'gif'),
+    (b'WEBP', 8, 'webp'),
+    (b'BM', 0, 'bmp'),
+]
+
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif',
+                 'webp': 'image/webp', 'bmp': 'image/bmp'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ImageError(ValueError):
+    """The upload could not be decoded as an image."""
+
+
+def sniff_format(data):
+    """The image format from its leading bytes, or None if unsupported."""
+    for magic, offset, fmt in _SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            if fmt == 'webp' and data[:4] != b'RIFF':
+                continue
+            return fmt
+    return None
+
+
+def _open(data, max_side):
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder scale down while decoding instead of after
+    image.draft('RGB', (max_side, max_side))
+    # Apply the EXIF orientation before the EXIF block is dropped
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    return image.convert('RGBA' if has_alpha else 'RGB'), has_alpha
+
+
+def _encode(image, fmt, **options):
+    out = io.BytesIO()
+    image.save(out, fmt, **options)
+    return out.getvalue()
+
+
+def prepare(data, max_side=2048, thumb_side=256):
+    """Normalize an uploaded image for Tripo and make its thumbnail.
+
+    The image is oriented, downscaled to fit max_side, stripped of metadata
+    and re-encoded as JPEG (PNG if it has transparency). Returns a dict with
+    image bytes, format ('jpg' or 'png', as Tripo names them), content_type,
+    and a WebP thumbnail.
+    """
+    from PIL import Image
+    try:
+        image, has_alpha = _open(data, max_side)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f"Could not read image ({type(e).__name__})") from None
+    if has_alpha:
+        normalized, fmt, content_type = _encode(image, 'PNG', optimize=True), 'png', 'image/png'
+    else:
+        normalized, fmt, content_type = _encode(image, 'JPEG', quality=90, optimize=True), 'jpg', 'image/jpeg'
+
+    image.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    thumbnail = _encode(image, 'WEBP', quality=80)
+    return {'image': normalized, 'format': fmt, 'content_type': content_type,
+            'thumbnail': thumbnail, 'thumbnail_content_type': 'image/webp'}
+
+
+def _get_pool(workers):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent runs worker and request threads
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _discard_pool(pool):
+    """Drop a pool whose child died so the next _get_pool starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+def prepare_in_pool(data, workers=2, **kwargs):
+    """prepare() in a child process; runs inline when workers is 0.
+
+    A child that dies (OOM kill, segfault in a decoder) breaks the whole
+    executor, so the pool is replaced and the call retried once. A second
+    failure raises BrokenProcessPool and the caller's job retries later.
+    """
+    if not workers:
+        return prepare(data, **kwargs)
+    for attempt in range(2):
+        pool = _get_pool(workers)
+        try:
+            return pool.submit(prepare, data, **kwargs).result()
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+
+def _reset_after_fork():
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
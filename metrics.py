@@ -0,0 +1,214 @@
+"""Prometheus metrics, timing spans and sampled request logs.
+
+    with metrics.span('tripo', 'get_task'):
+        ...
+
+Every span observes external_call_duration_seconds{service,operation,outcome}
+and is attributed to the request or job running on the current thread
+(greenlet under gevent), along with the SQL queries it executes. Per request
+that gives http_request_duration_seconds plus http_request_db_queries /
+http_request_db_seconds, and one structured JSON log line for a sample of
+requests (LOG_SAMPLE_RATE), every 5xx and every request slower than
+SLOW_REQUEST_SECONDS. Jobs get the same via trace() in worker.run_job.
+
+Gauges that describe shared state (Tripo tasks in flight, pending jobs) are
+read from the database at scrape time. render() produces the /metrics body;
+with PROMETHEUS_MULTIPROC_DIR set it aggregates all gunicorn workers.
+"""
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency',
+                            ['method', 'route', 'status'])
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'SQL queries per request', ['route'],
+                               buckets=QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in SQL per request', ['route'])
+EXTERNAL_SECONDS = Histogram('external_call_duration_seconds', 'Calls to Tripo and object storage',
+                             ['service', 'operation', 'outcome'])
+DB_QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Duration of single SQL statements',
+                             buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+JOB_SECONDS = Histogram('job_duration_seconds', 'Background job runs', ['kind', 'outcome'])
+JOBS_TOTAL = Counter('jobs_total', 'Background job runs', ['kind', 'outcome'])
+WEBHOOKS_TOTAL = Counter('tripo_webhooks_total', 'Tripo task notifications received', ['outcome'])
+
+_local = threading.local()
+
+
+class Trace:
+    """What one request or job spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.spans = {}
+
+    def add_span(self, name, seconds):
+        count, total = self.spans.get(name, (0, 0.0))
+        self.spans[name] = (count + 1, total + seconds)
+
+    def summary(self):
+        return {
+            'db_queries': self.queries,
+            'db_ms': round(self.db_seconds * 1000, 1),
+            'spans': {name: {'count': count, 'ms': round(total * 1000, 1)}
+                      for name, (count, total) in self.spans.items()},
+        }
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace():
+    """Attribute spans and queries on this thread to a new Trace until exit."""
+    previous = current_trace()
+    _local.trace = Trace()
+    try:
+        yield _local.trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(service, operation):
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_SECONDS.labels(service, operation, outcome).observe(elapsed)
+        current = current_trace()
+        if current is not None:
+            current.add_span(f'{service}.{operation}', elapsed)
+
+
+def timed(service, operation):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(service, operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def should_log(status, seconds, config):
+    return (status >= 500 or seconds >= config.get('SLOW_REQUEST_SECONDS', 1.0)
+            or random.random() < config.get('LOG_SAMPLE_RATE', 0.1))
+
+
+# SQLAlchemy
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        DB_QUERY_SECONDS.observe(elapsed)
+        current = current_trace()
+        if current is not None:
+            current.queries += 1
+            current.db_seconds += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+
+
+# Flask
+
+def init_app(app):
+    from flask import request
+
+    @app.before_request
+    def _start_request_trace():
+        _local.trace = Trace()
+
+    @app.after_request
+    def _record_request(response):
+        current = current_trace()
+        if current is None:
+            return response
+        elapsed = time.perf_counter() - current.started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(elapsed)
+        REQUEST_DB_QUERIES.labels(route).observe(current.queries)
+        REQUEST_DB_SECONDS.labels(route).observe(current.db_seconds)
+        if should_log(response.status_code, elapsed, app.config):
+            logger.info(json.dumps(dict({
+                'event': 'request', 'method': request.method, 'path': request.path, 'route': route,
+                'status': response.status_code, 'ms': round(elapsed * 1000, 1),
+            }, **current.summary())))
+        return response
+
+    @app.teardown_request
+    def _end_request_trace(exc):
+        _local.trace = None
+
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        REGISTRY.register(StateCollector(app))
+
+
+class StateCollector:
+    """Gauges computed from the database when /metrics is scraped."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def describe(self):
+        # Keeps registration from calling collect() before the tables exist
+        return []
+
+    def collect(self):
+        from models import db, Model, Job, STATUS_QUEUED, STATUS_RUNNING, JOB_PENDING, JOB_RUNNING
+        with self.app.app_context():
+            in_flight = db.session.query(db.func.count(Model.id)).filter(
+                Model.task_id.isnot(None), Model.model_url.is_(None), Model.status == STATUS_RUNNING).scalar()
+            queued = db.session.query(db.func.count(Model.id)).filter(Model.status == STATUS_QUEUED).scalar()
+            jobs = (db.session.query(Job.kind, Job.state, db.func.count(Job.id))
+                    .filter(Job.state.in_([JOB_PENDING, JOB_RUNNING])).group_by(Job.kind, Job.state).all())
+            db.session.remove()
+        yield GaugeMetricFamily('tripo_tasks_in_flight', 'Models with a Tripo task still running', value=in_flight)
+        yield GaugeMetricFamily('models_queued', 'Models waiting to be submitted to Tripo', value=queued)
+        family = GaugeMetricFamily('jobs_open', 'Pending and running background jobs', labels=['kind', 'state'])
+        for kind, state, count in jobs:
+            family.add_metric([kind, state], count)
+        yield family
+
+
+def render(app):
+    """(body, content type) for the /metrics endpoint."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(StateCollector(app))
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,98 @@
+"""Versioned schema upgrades.
+
+db.create_all() only creates missing tables, it never alters existing ones.
+Every change to an existing table gets an entry in MIGRATIONS; upgrade()
+applies the ones newer than the version recorded in the schema_version table.
+Migrations must be safe to run against a database that create_all() just
+built from the current models.
+"""
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+def _add_column(conn, table, name, ddl):
+    if name not in _columns(conn, table):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+
+def _model_status_columns(conn):
+    _add_column(conn, 'model', 'status', 'VARCHAR(16)')
+    _add_column(conn, 'model', 'progress', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'model', 'error', 'VARCHAR(512)')
+    _add_column(conn, 'model', 'updated_at', 'TIMESTAMP')
+    conn.execute(text("UPDATE model SET status = 'succeeded', progress = 100 "
+                      "WHERE status IS NULL AND model_url IS NOT NULL"))
+    conn.execute(text("UPDATE model SET status = 'running' WHERE status IS NULL"))
+
+
+def _model_upload_key(conn):
+    _add_column(conn, 'model', 'upload_key', 'VARCHAR(64)')
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_model_user_upload_key ON model (user_id, upload_key)'))
+
+
+def _model_generation(conn):
+    # The generation table itself is created by create_all()
+    _add_column(conn, 'model', 'image_sha256', 'VARCHAR(64)')
+    _add_column(conn, 'model', 'generation_id', 'INTEGER REFERENCES generation (id)')
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_model_generation_id ON model (generation_id)'))
+
+
+def _model_listing_indexes(conn):
+    conn.execute(text('UPDATE model SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_model_user_id_created_at ON model (user_id, created_at DESC)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_model_task_id ON model (task_id)'))
+
+
+def _model_thumbnail(conn):
+    _add_column(conn, 'model', 'thumbnail_url', 'VARCHAR(256)')
+
+
+def _model_gz_url(conn):
+    _add_column(conn, 'model', 'model_gz_url', 'VARCHAR(256)')
+
+
+def _model_state_timestamps(conn):
+    _add_column(conn, 'model', 'started_at', 'TIMESTAMP')
+    _add_column(conn, 'model', 'finished_at', 'TIMESTAMP')
+
+
+def _job_model_index(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_job_kind_model_id ON job (kind, model_id)'))
+
+
+def _model_notified_at(conn):
+    _add_column(conn, 'model', 'notified_at', 'TIMESTAMP')
+
+
+MIGRATIONS = [
+    (1, 'model status columns', _model_status_columns),
+    (2, 'model upload idempotency key', _model_upload_key),
+    (3, 'model generation link', _model_generation),
+    (4, 'model listing and task_id indexes', _model_listing_indexes),
+    (5, 'model thumbnail', _model_thumbnail),
+    (6, 'model gzip variant', _model_gz_url),
+    (7, 'model state timestamps', _model_state_timestamps),
+    (8, 'job kind and model_id index', _job_model_index),
+    (9, 'model webhook notification time', _model_notified_at),
+]
+
+
+def current_version(conn):
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    version = conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"Applying migration {number}: {description}")
+            migrate(conn)
+            conn.execute(text('INSERT INTO schema_version (version) VALUES (:v)'), {'v': number})
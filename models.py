@@ -0,0 +1,137 @@
+import datetime
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+db = SQLAlchemy()
+
+# Model.status values
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+# Job.state values
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), unique=True, nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
+    is_admin = db.Column(db.Boolean, default=False)
+
+    def set_password(self, password, method='scrypt'):
+        # method is a werkzeug hash spec, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+        self.password_hash = generate_password_hash(password, method=method)
+
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+
+    def password_needs_rehash(self, method):
+        """True if the stored hash was made with other parameters than `method` (in full form)."""
+        return self.password_hash.split('$', 1)[0] != method
+
+class Model(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    image_url = db.Column(db.String(256), nullable=False)
+    model_url = db.Column(db.String(256), nullable=True)
+    task_id = db.Column(db.String(64), nullable=True, index=True)
+    name = db.Column(db.String(128), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Add timestamp
+    # Written by the background worker, read by /status
+    status = db.Column(db.String(16), nullable=True, default=STATUS_RUNNING)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(512), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True, default=utcnow, onupdate=utcnow)
+    # Client-supplied Idempotency-Key of the upload that created this row
+    upload_key = db.Column(db.String(64), nullable=True)
+    # Content hash of the uploaded image and the Tripo run that produced (or will produce) the GLB
+    image_sha256 = db.Column(db.String(64), nullable=True)
+    generation_id = db.Column(db.Integer, db.ForeignKey('generation.id'), nullable=True, index=True)
+    # Small WebP preview, written by the submit job
+    thumbnail_url = db.Column(db.String(256), nullable=True)
+    # gzip-encoded copy of the GLB, written by the compress job
+    model_gz_url = db.Column(db.String(256), nullable=True)
+    # When the model got its Tripo task, and when it reached succeeded or failed
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # When a Tripo webhook said the task finished (worker.record_task_event)
+    notified_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship('User', backref=db.backref('models', lazy='dynamic'))
+
+    # sqlite_autoincrement: SQLite would otherwise hand a deleted model's id to the next one
+    __table_args__ = (db.Index('uq_model_user_upload_key', 'user_id', 'upload_key', unique=True),
+                      {'sqlite_autoincrement': True})
+
+    @property
+    def state(self):
+        # Rows created before the status column existed have status NULL
+        if self.model_url:
+            return STATUS_SUCCEEDED
+        return self.status or STATUS_RUNNING
+
+    def set_status(self, status):
+        """Move to `status`, stamping started_at / finished_at on first entry."""
+        if status == STATUS_RUNNING and self.started_at is None:
+            self.started_at = utcnow()
+        if status in (STATUS_SUCCEEDED, STATUS_FAILED) and self.finished_at is None:
+            self.finished_at = utcnow()
+        self.status = status
+
+# Per-user listings, newest first (/models, /api/models)
+db.Index('ix_model_user_id_created_at', Model.user_id, Model.created_at.desc())
+
+class Generation(db.Model):
+    """One Tripo image-to-3D run, keyed by image content and generation parameters.
+
+    Models uploaded with the same bytes and parameters share a Generation
+    instead of each paying for a new task.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    image_sha256 = db.Column(db.String(64), nullable=False)
+    params_hash = db.Column(db.String(64), nullable=False)
+    # The model whose submit job creates the Tripo task
+    owner_model_id = db.Column(db.Integer, nullable=True)
+    task_id = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(16), nullable=False, default=STATUS_RUNNING)
+    # Storage name of a finished GLB to copy from
+    model_object = db.Column(db.String(256), nullable=True)
+    created_at = db.Column(db.DateTime, default=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (db.Index('uq_generation_image_params', 'image_sha256', 'params_hash', unique=True),)
+
+class Job(db.Model):
+    """A unit of background work, claimed by worker.py with a time-limited lease."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    # One live job per key, e.g. "finalize:42"
+    key = db.Column(db.String(128), unique=True, nullable=False)
+    model_id = db.Column(db.Integer, nullable=True)
+    state = db.Column(db.String(16), nullable=False, default=JOB_PENDING, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+    # reconcile() outer-joins on (kind, model_id) every run
+    __table_args__ = (db.Index('ix_job_kind_model_id', 'kind', 'model_id'),)
+
+class BlobDeletion(db.Model):
+    """A storage object whose model row is gone but whose delete hasn't
+    succeeded yet. Drained by the worker's delete_blobs job."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(256), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=utcnow)
@@ -0,0 +1,51 @@
+"""Keyset (cursor) pagination helpers.
+
+A page is ordered by (sort column, id) and the cursor is the position of its
+last row, so fetching page N costs the same as page 1, unlike OFFSET.
+Cursors are opaque url-safe strings.
+"""
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, is_datetime=False):
+    """Returns (value, id); raises ValueError for a malformed cursor."""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if is_datetime and value is not None:
+            value = datetime.datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(query, column, id_column, cursor=None, descending=True, limit=50, is_datetime=False):
+    """Order `query` by (column, id) and return (rows, next_cursor).
+
+    `column` must not produce NULLs (wrap nullable columns in coalesce()).
+    The query must select a single entity; the sort key is fetched alongside
+    it to build the cursor. next_cursor is None on the last page.
+    """
+    if cursor:
+        value, row_id = decode_cursor(cursor, is_datetime)
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, id_column < row_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, id_column > row_id)))
+    order = (column.desc(), id_column.desc()) if descending else (column.asc(), id_column.asc())
+    rows = query.add_columns(column.label('_sort_key'), id_column.label('_sort_id')) \
+                .order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._sort_key, rows[-1]._sort_id)
+    return [row[0] for row in rows], next_cursor
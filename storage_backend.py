@@ -0,0 +1,395 @@
+"""Object storage backends.
+
+Routes and the worker talk to storage through get_storage(), which returns
+one long-lived backend per process:
+
+    gcs     Google Cloud Storage bucket BUCKET_NAME (default). One
+            storage.Client, and therefore one credential lookup and one
+            keep-alive connection pool, per worker process.
+    local   Files under LOCAL_STORAGE_ROOT, served by the app at /storage/.
+            For on-prem installs and local development.
+    memory  A dict. For tests and benchmarks.
+
+Objects are addressed by name ("images/3/bike.jpeg"); public_url() and
+name_from_url() convert between names and the URLs stored on Model rows.
+
+signed_upload_url() lets clients PUT an object straight to storage: a V4
+signed URL on GCS, or a token-protected URL on this app (PUT /storage/<name>)
+for the local and memory backends.
+"""
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import quote, unquote
+
+import metrics
+
+_lock = threading.Lock()
+_storage = None
+
+# Deletes per GCS batch request (the JSON API allows up to 100)
+DELETE_BATCH_SIZE = 100
+
+
+class GCSStorage:
+    def __init__(self, bucket_name, pool_size=10):
+        self.bucket_name = bucket_name
+        self.pool_size = pool_size
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    # Imported here so processes that never touch GCS don't pay for it
+                    from google.cloud import storage
+                    from requests.adapters import HTTPAdapter
+                    with metrics.span('gcs', 'client_init'):
+                        client = storage.Client()
+                    client._http.mount('https://', HTTPAdapter(pool_connections=self.pool_size,
+                                                               pool_maxsize=self.pool_size))
+                    self._bucket = client.bucket(self.bucket_name)
+        return self._bucket
+
+    def public_url(self, name):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{quote(name, safe='/~')}"
+
+    def name_from_url(self, url):
+        prefix = f"https://storage.googleapis.com/{self.bucket_name}/"
+        if url.startswith(prefix):
+            return unquote(url[len(prefix):])
+        # Legacy rows: images/<user>/<file> and models/<user>/<file>
+        return unquote('/'.join(url.split('/')[-3:]))
+
+    @metrics.timed('gcs', 'upload_bytes')
+    def upload_bytes(self, name, data, content_type=None):
+        self.bucket.blob(name).upload_from_string(data, content_type=content_type)
+        return self.public_url(name)
+
+    @metrics.timed('gcs', 'open_writer')
+    def open_writer(self, name, content_type=None, chunk_size=None, cache_control=None):
+        # BlobWriter buffers chunk_size bytes (default 40 MiB), so always pass one
+        blob = self.bucket.blob(name)
+        blob.cache_control = cache_control
+        return blob.open('wb', chunk_size=chunk_size, content_type=content_type)
+
+    @metrics.timed('gcs', 'open_reader')
+    def open_reader(self, name, chunk_size=None):
+        """A seekable file object that downloads chunk_size bytes at a time."""
+        return self.bucket.blob(name).open('rb', chunk_size=chunk_size)
+
+    @metrics.timed('gcs', 'read')
+    def read(self, name):
+        return self.bucket.blob(name).download_as_bytes()
+
+    @metrics.timed('gcs', 'size')
+    def size(self, name):
+        blob = self.bucket.get_blob(name)
+        return blob.size if blob else None
+
+    @metrics.timed('gcs', 'exists')
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    @metrics.timed('gcs', 'md5')
+    def md5(self, name):
+        blob = self.bucket.get_blob(name)
+        return blob.md5_hash if blob else None
+
+    @metrics.timed('gcs', 'copy')
+    def copy(self, src, dst):
+        # Metadata (content type, Cache-Control) comes along with the object
+        self.bucket.copy_blob(self.bucket.blob(src), self.bucket, dst)
+
+    @metrics.timed('gcs', 'signed_upload_url')
+    def signed_upload_url(self, name, content_type, expires_in, max_bytes):
+        """(url, headers) for a single PUT of `name`; the client must send the headers."""
+        headers = {'Content-Type': content_type, 'x-goog-content-length-range': f'0,{max_bytes}'}
+        signing = {}
+        credentials = self.bucket.client._credentials
+        if not hasattr(credentials, 'sign_bytes'):
+            # Metadata-server credentials (Cloud Run, GCE) have no private key;
+            # sign through the IAM API as the service account instead
+            from google.auth.transport.requests import Request
+            if not credentials.valid:
+                credentials.refresh(Request())
+            signing = {'service_account_email': credentials.service_account_email,
+                       'access_token': credentials.token}
+        url = self.bucket.blob(name).generate_signed_url(
+            version='v4', method='PUT', expiration=datetime.timedelta(seconds=expires_in),
+            content_type=content_type,
+            headers={'x-goog-content-length-range': headers['x-goog-content-length-range']}, **signing)
+        return url, headers
+
+    @metrics.timed('gcs', 'delete')
+    def delete(self, name):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            pass
+
+    @metrics.timed('gcs', 'delete_many')
+    def delete_many(self, names):
+        """Delete up to DELETE_BATCH_SIZE objects per HTTP request. Returns the
+        names that could not be deleted; missing objects count as deleted."""
+        failed = []
+        for start in range(0, len(names), DELETE_BATCH_SIZE):
+            chunk = names[start:start + DELETE_BATCH_SIZE]
+            try:
+                with self.bucket.client.batch(raise_exception=False) as batch:
+                    for name in chunk:
+                        self.bucket.blob(name).delete()
+            except Exception:
+                failed.extend(chunk)
+                continue
+            # One sub-response per deferred delete, in order
+            for name, response in zip(chunk, batch._responses):
+                if not (200 <= response.status_code < 300 or response.status_code == 404):
+                    failed.append(name)
+        return failed
+
+
+class _Writer(io.RawIOBase):
+    """Buffers up to chunk_size bytes, flushes whole chunks to `tmp`, and only
+    makes the object visible on close(), like a resumable GCS upload. Records
+    the largest buffer it held on the backend's peak_buffered."""
+
+    def __init__(self, backend, name, tmp, chunk_size, content_type, cache_control=None):
+        self.backend = backend
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self._buffer = bytearray()
+        self._tmp = tmp
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self.backend.peak_buffered = max(self.backend.peak_buffered, len(self._buffer))
+        while len(self._buffer) >= self.chunk_size:
+            self._tmp.write(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._tmp.write(self._buffer)
+            self._buffer = bytearray()
+            self.backend._commit(self.name, self._tmp, self.content_type, self.cache_control)
+        super().close()
+
+
+class MemoryStorage:
+    def __init__(self, base_url='/storage', secret_key=None):
+        self.base_url = base_url.rstrip('/')
+        self.secret_key = secret_key
+        self.objects = {}
+        self.content_types = {}
+        self.cache_controls = {}
+        self.peak_buffered = 0
+
+    def public_url(self, name):
+        return f"{self.base_url}/{quote(name, safe='/~')}"
+
+    def name_from_url(self, url):
+        prefix = self.base_url + '/'
+        return unquote(url[len(prefix):] if url.startswith(prefix) else '/'.join(url.split('/')[-3:]))
+
+    def upload_bytes(self, name, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.open_writer(name, content_type, chunk_size=max(len(data), 1)) as writer:
+            writer.write(data)
+        return self.public_url(name)
+
+    def open_writer(self, name, content_type=None, chunk_size=None, cache_control=None):
+        return _Writer(self, name, self._open_tmp(name), chunk_size or 40 * 1024 * 1024, content_type,
+                       cache_control)
+
+    def open_reader(self, name, chunk_size=None):
+        return io.BytesIO(self.read(name))
+
+    def signed_upload_url(self, name, content_type, expires_in, max_bytes):
+        from itsdangerous import URLSafeTimedSerializer
+        token = URLSafeTimedSerializer(self.secret_key, salt='storage-upload').dumps(
+            {'name': name, 'content_type': content_type, 'max_bytes': max_bytes, 'expires_in': expires_in})
+        return f"{self.public_url(name)}?token={token}", {'Content-Type': content_type}
+
+    def check_upload_token(self, token, name):
+        """The token's claims if it authorizes a PUT of `name`; raises ValueError otherwise."""
+        from itsdangerous import BadSignature, URLSafeTimedSerializer
+        serializer = URLSafeTimedSerializer(self.secret_key, salt='storage-upload')
+        try:
+            claims, signed_at = serializer.loads(token, return_timestamp=True)
+        except BadSignature as e:
+            raise ValueError("Invalid upload token") from e
+        age = (datetime.datetime.now(datetime.timezone.utc) - signed_at).total_seconds()
+        if claims.get('name') != name or age > claims.get('expires_in', 0):
+            raise ValueError("Upload token expired or issued for another object")
+        return claims
+
+    def read(self, name):
+        return self.objects[name]
+
+    def exists(self, name):
+        return name in self.objects
+
+    def size(self, name):
+        return len(self.objects[name]) if name in self.objects else None
+
+    def md5(self, name):
+        if not self.exists(name):
+            return None
+        return base64.b64encode(hashlib.md5(self.read(name)).digest()).decode()
+
+    def metadata(self, name):
+        """(content type, Cache-Control) the object was stored with."""
+        return self.content_types.get(name), self.cache_controls.get(name)
+
+    def copy(self, src, dst):
+        self._commit(dst, io.BytesIO(self.read(src)), *self.metadata(src))
+
+    def delete(self, name):
+        self.objects.pop(name, None)
+        self.content_types.pop(name, None)
+        self.cache_controls.pop(name, None)
+
+    def delete_many(self, names):
+        failed = []
+        for name in names:
+            try:
+                self.delete(name)
+            except OSError:
+                failed.append(name)
+        return failed
+
+    def _open_tmp(self, name):
+        return io.BytesIO()
+
+    def _commit(self, name, tmp, content_type, cache_control=None):
+        self.objects[name] = tmp.getvalue()
+        self.content_types[name] = content_type
+        self.cache_controls[name] = cache_control
+
+
+# LocalStorage keeps each object's content type and Cache-Control here
+METADATA_DIR = '.meta'
+
+
+class LocalStorage(MemoryStorage):
+    def __init__(self, root, base_url='/storage', secret_key=None):
+        super().__init__(base_url, secret_key)
+        self.root = root
+
+    def path(self, name):
+        path = os.path.realpath(os.path.join(self.root, *name.split('/')))
+        if not path.startswith(os.path.realpath(self.root) + os.sep):
+            raise ValueError(f"Object name escapes storage root: {name}")
+        return path
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def exists(self, name):
+        return not name.startswith(METADATA_DIR + '/') and os.path.isfile(self.path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.path(name)) if self.exists(name) else None
+
+    def open_reader(self, name, chunk_size=None):
+        return open(self.path(name), 'rb')
+
+    def md5(self, name):
+        if not self.exists(name):
+            return None
+        digest = hashlib.md5()
+        with open(self.path(name), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return base64.b64encode(digest.digest()).decode()
+
+    def metadata_path(self, name):
+        # Sidecar JSON under .meta/, so every process (and a restart) sees it
+        return self.path(f'{METADATA_DIR}/{name}.json')
+
+    def metadata(self, name):
+        try:
+            with open(self.metadata_path(name)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None, None
+        return meta.get('content_type'), meta.get('cache_control')
+
+    def copy(self, src, dst):
+        with open(self.path(src), 'rb') as f, self._open_tmp(dst) as tmp:
+            shutil.copyfileobj(f, tmp)
+        self._commit(dst, tmp, *self.metadata(src))
+
+    def delete(self, name):
+        for path in (self.path(name), self.metadata_path(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _open_tmp(self, name):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=directory, suffix='.upload', delete=False)
+
+    def _commit(self, name, tmp, content_type, cache_control=None):
+        tmp.close()
+        # Metadata first: a reader that finds the object also finds its headers
+        with self._open_tmp(f'{METADATA_DIR}/{name}.json') as meta:
+            meta.write(json.dumps({'content_type': content_type, 'cache_control': cache_control}).encode())
+        os.replace(meta.name, self.metadata_path(name))
+        os.replace(tmp.name, self.path(name))
+
+
+def create_storage(config):
+    backend = config.get('STORAGE_BACKEND', 'gcs')
+    if backend == 'gcs':
+        return GCSStorage(config['BUCKET_NAME'], pool_size=config.get('STORAGE_POOL_SIZE', 10))
+    if backend == 'local':
+        return LocalStorage(config['LOCAL_STORAGE_ROOT'], secret_key=config.get('SECRET_KEY'))
+    if backend == 'memory':
+        return MemoryStorage(secret_key=config.get('SECRET_KEY'))
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+def get_storage(app=None):
+    """The process-wide storage backend, created on first use."""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                if app is None:
+                    from flask import current_app as app
+                _storage = create_storage(app.config)
+    return _storage
+
+def set_storage(backend):
+    """Replace the process-wide backend (tests, benchmarks)."""
+    global _storage
+    _storage = backend
+
+def _reset_after_fork():
+    # Connection pools must not be shared across a fork
+    global _storage, _lock
+    _storage = None
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,252 @@
+"""Client for the Tripo v2 openapi.
+
+One TripoClient per process (get_tripo_client) shares a keep-alive
+requests.Session, applies per-endpoint timeouts, retries throttled and
+transient failures with jittered exponential backoff (honoring
+Retry-After), and rate-limits itself to the account quota so a burst of
+uploads queues here instead of being rejected by Tripo.
+
+Task notifications posted to /api/tripo/webhook are checked with
+verify_webhook(): an HMAC-SHA256, keyed with TRIPO_WEBHOOK_SECRET, of
+"<X-Tripo-Timestamp>.<raw body>" sent hex-encoded in X-Tripo-Signature.
+"""
+import email.utils
+import hashlib
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.tripo3d.ai/v2/openapi'
+
+# (connect, read) seconds per endpoint
+TIMEOUTS = {
+    'upload': (5, 60),
+    'create_task': (5, 30),
+    'get_task': (5, 15),
+    'download': (5, 30),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Creating a task is not idempotent: a 500/502/504 may still have started a
+# (billed) generation, so only retry when Tripo says the request was refused.
+# The same goes for network errors: only retry those that happened before the
+# request could have been sent (see request_was_sent).
+CREATE_TASK_RETRY_STATUSES = {429, 503}
+
+_lock = threading.Lock()
+_client = None
+
+
+class TripoError(Exception):
+    """Tripo answered with a non-zero `code`."""
+    def __init__(self, message, code=None, response=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.response = response
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def request_was_sent(error):
+    """False if a ConnectionError/Timeout certainly happened before the
+    request reached the server (connect timeout, refused, DNS failure);
+    True if it may have been received and acted on."""
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    reason = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying error
+    reason = getattr(reason, 'reason', reason)
+    return not isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TripoClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, pool_size=10, max_retries=4,
+                 backoff=0.5, max_backoff=30, rate_limit=None, burst=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(rate_limit, burst or pool_size) if rate_limit else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _sleep(self, attempt, response=None):
+        delay = _retry_after(response)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        time.sleep(min(delay, self.max_backoff))
+
+    def request(self, method, url, endpoint, retry_statuses=RETRY_STATUSES, idempotent=True, **kwargs):
+        """Send a request with retries; raises requests.HTTPError on a final 4xx/5xx.
+        Unless `idempotent`, network errors are only retried if the request
+        was never sent."""
+        kwargs.setdefault('timeout', TIMEOUTS[endpoint])
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                with metrics.span('tripo', endpoint):
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries or (not idempotent and request_was_sent(e)):
+                    raise
+                logger.warning(f"Tripo {endpoint} failed ({str(e)}), retrying")
+                self._sleep(attempt)
+                continue
+            if response.status_code in retry_statuses and attempt < self.max_retries:
+                logger.warning(f"Tripo {endpoint} returned {response.status_code}, retrying")
+                self._sleep(attempt, response)
+                response.close()
+                continue
+            response.raise_for_status()
+            return response
+
+    def _json(self, response):
+        body = response.json()
+        if body.get("code") != 0:
+            raise TripoError(body.get('message', 'Unknown error'), code=body.get("code"), response=response)
+        return body["data"]
+
+    def upload_image(self, filename, data, content_type):
+        """Upload image bytes; returns the image token used by create_task."""
+        files = {'file': (filename, data, content_type)}
+        # The multipart body is rebuilt on every attempt, so retrying is safe
+        response = self.request('POST', f"{self.base_url}/upload", 'upload', headers=self.headers, files=files)
+        return self._json(response)["image_token"]
+
+    def create_task(self, payload):
+        response = self.request('POST', f"{self.base_url}/task", 'create_task',
+                                retry_statuses=CREATE_TASK_RETRY_STATUSES, idempotent=False,
+                                headers=self.headers, json=payload)
+        return self._json(response)["task_id"]
+
+    def get_task(self, task_id):
+        response = self.request('GET', f"{self.base_url}/task/{task_id}", 'get_task', headers=self.headers)
+        return self._json(response)
+
+    def download(self, url):
+        """Streamed GET of a result file; use as a context manager."""
+        return self.request('GET', url, 'download', stream=True)
+
+
+WEBHOOK_TOLERANCE = 300
+
+
+def verify_webhook(body, timestamp, signature, secret, tolerance=WEBHOOK_TOLERANCE):
+    """True if `signature` signs `body` at `timestamp`, and `timestamp` is
+    within `tolerance` seconds of now (so a captured call can't be replayed
+    later)."""
+    if not (secret and timestamp and signature):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except ValueError:
+        return False
+    expected = hmac.new(secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    return hmac.compare_digest(expected, signature)
+
+def parse_webhook(payload):
+    """(task_id, status, progress) from a task notification; Tripo wraps the
+    task in "data" like its GET /task response."""
+    task = payload.get('data', payload) if isinstance(payload, dict) else None
+    if not isinstance(task, dict) or not task.get('task_id'):
+        return None
+    try:
+        progress = int(task.get('progress') or 0)
+    except (TypeError, ValueError):
+        progress = 0
+    return str(task['task_id']), task.get('status'), max(0, min(progress, 100))
+
+
+def create_tripo_client(config):
+    return TripoClient(
+        config.get('TRIPO_API_KEY'),
+        base_url=config.get('TRIPO_API_BASE', DEFAULT_BASE_URL),
+        pool_size=config.get('TRIPO_POOL_SIZE', 10),
+        max_retries=config.get('TRIPO_MAX_RETRIES', 4),
+        rate_limit=config.get('TRIPO_RATE_LIMIT'),
+        burst=config.get('TRIPO_RATE_BURST'),
+    )
+
+def get_tripo_client(app=None):
+    """The process-wide Tripo client, created on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                if app is None:
+                    from flask import current_app as app
+                _client = create_tripo_client(app.config)
+    return _client
+
+def set_tripo_client(client):
+    """Replace the process-wide client (tests, benchmarks)."""
+    global _client
+    _client = client
+
+def _reset_after_fork():
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
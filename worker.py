@@ -0,0 +1,749 @@
+"""Background job worker.
+
+Jobs live in the `job` table so they survive restarts and can be shared by
+several processes. A worker claims a job by atomically moving it to
+`running` with a lease (`locked_until`); a job whose lease expires (worker
+crashed mid-job) becomes claimable again.
+
+Run standalone with `python worker.py`, or in-process via start_worker(app)
+(each gunicorn worker does this when RUN_WORKER=1, see gunicorn.conf.py).
+The Cloud Run deploy (cloudbuild.yaml) uses the in-process worker, so the
+service runs with CPU always allocated and one instance kept warm; a
+service with default request-only CPU must run `python worker.py`
+somewhere that is always on instead.
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from sqlalchemy import or_, and_, update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from images import ImageError, prepare_in_pool, sniff_format, CONTENT_TYPES
+from storage_backend import get_storage
+from tripo import get_tripo_client, request_was_sent, TripoError, CREATE_TASK_RETRY_STATUSES
+from models import (db, Model, Generation, Job, BlobDeletion, utcnow, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED,
+                    JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+
+logger = logging.getLogger('worker')
+
+# A running job's lease is renewed every LEASE_RENEW_SECONDS (see Lease). It
+# outlasts the slowest single Tripo call with all its retries (5 x 65s
+# upload timeouts + 4 x 30s backoff), so even a missed renewal can't expire
+# it in the middle of create_task.
+LEASE_SECONDS = 600
+LEASE_RENEW_SECONDS = 60
+MAX_ATTEMPTS = 8
+# GLB transfers: resumable upload chunk (a multiple of 256 KiB) and HTTP read size
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+# Finished GLBs never change under their content-addressed names
+GLB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Storage objects handled per delete_blobs run
+DELETE_BLOBS_LIMIT = 1000
+
+
+class LeaseLost(Exception):
+    """The job's lease ran out; another worker may have claimed it."""
+
+
+class Retry(Exception):
+    """Raised by a handler to run the job again later without counting a failure."""
+    def __init__(self, delay):
+        super().__init__(f"retry in {delay}s")
+        self.delay = delay
+
+
+def enqueue(kind, key, model_id=None, delay=0):
+    """Insert a job unless one with the same key already exists. Returns True if inserted."""
+    job = Job(kind=kind, key=key, model_id=model_id,
+              run_at=utcnow() + datetime.timedelta(seconds=delay))
+    db.session.add(job)
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def schedule_blob_deletion(delay=0):
+    """Make sure the delete_blobs job will run. There is one such job; once
+    it has finished it is reset to pending rather than inserted again."""
+    if enqueue('delete_blobs', 'delete_blobs', delay=delay):
+        return
+    Job.query.filter(Job.key == 'delete_blobs', Job.state.in_([JOB_DONE, JOB_FAILED])).update(
+        {Job.state: JOB_PENDING, Job.attempts: 0, Job.last_error: None,
+         Job.run_at: utcnow() + datetime.timedelta(seconds=delay)},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def prune_jobs(retention):
+    """Delete done and failed jobs last touched more than `retention` seconds
+    ago. The delete_blobs row is kept since schedule_blob_deletion reuses it."""
+    cutoff = utcnow() - datetime.timedelta(seconds=retention)
+    pruned = (Job.query
+              .filter(Job.state.in_([JOB_DONE, JOB_FAILED]), Job.updated_at < cutoff, Job.key != 'delete_blobs')
+              .delete(synchronize_session=False))
+    db.session.commit()
+    return pruned
+
+
+def claim_job(kinds):
+    """Lease the next due job of one of `kinds`, or return None."""
+    now = utcnow()
+    claimable = or_(
+        and_(Job.state == JOB_PENDING, Job.run_at <= now),
+        and_(Job.state == JOB_RUNNING, Job.locked_until < now),
+    )
+    candidates = (Job.query.filter(claimable, Job.kind.in_(kinds))
+                  .order_by(Job.run_at).limit(10).all())
+    for job in candidates:
+        # Conditional update: only one worker wins the row
+        claimed = Job.query.filter(Job.id == job.id, claimable).update(
+            {Job.state: JOB_RUNNING,
+             Job.locked_until: now + datetime.timedelta(seconds=LEASE_SECONDS),
+             Job.attempts: Job.attempts + 1},
+            synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+    return None
+
+
+class Lease:
+    """Keeps a claimed job's lease alive while its handler runs.
+
+    A thread pushes locked_until forward every LEASE_RENEW_SECONDS, on its
+    own connection, conditional on the value it last wrote; if another
+    worker has reclaimed the job the update matches nothing and the lease
+    is lost. Handlers call check() before anything that must not happen
+    twice.
+    """
+
+    def __init__(self, app, job):
+        self.app = app
+        self.job_id = job.id
+        self.locked_until = job.locked_until
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'lease-{job.id}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(LEASE_RENEW_SECONDS):
+            if not self.renew():
+                return
+
+    def renew(self):
+        locked_until = utcnow() + datetime.timedelta(seconds=LEASE_SECONDS)
+        try:
+            with self.app.app_context(), db.engine.begin() as conn:
+                renewed = conn.execute(update(Job).where(
+                    Job.id == self.job_id, Job.state == JOB_RUNNING, Job.locked_until == self.locked_until,
+                ).values(locked_until=locked_until)).rowcount
+        except Exception as e:
+            # Try again next time; the lease has room for a few misses
+            logger.warning(f"Could not renew the lease on job {self.job_id}: {str(e)}")
+            return True
+        if not renewed:
+            self.lost = True
+            logger.error(f"Lost the lease on job {self.job_id}")
+            return False
+        self.locked_until = locked_until
+        return True
+
+    def check(self):
+        if self.lost or utcnow() >= self.locked_until:
+            raise LeaseLost(f"lease on job {self.job_id} expired")
+
+
+def _backoff(attempts):
+    return min(600, 5 * 2 ** attempts) * random.uniform(0.5, 1.0)
+
+
+def delete_blobs(worker, job):
+    """Retry storage deletes that failed when their models were deleted.
+
+    Keeps rescheduling itself (without counting failures) until every
+    BlobDeletion row is gone, backing off while storage keeps refusing.
+    """
+    pending = BlobDeletion.query.order_by(BlobDeletion.id).limit(DELETE_BLOBS_LIMIT).all()
+    if not pending:
+        return
+    failed = set(worker.storage.delete_many([p.name for p in pending]))
+    done_ids = [p.id for p in pending if p.name not in failed]
+    if done_ids:
+        BlobDeletion.query.filter(BlobDeletion.id.in_(done_ids)).delete(synchronize_session=False)
+    for p in pending:
+        if p.name in failed:
+            p.attempts += 1
+    db.session.commit()
+    logger.info(f"Deleted {len(done_ids)} storage objects, {len(failed)} still failing")
+    if failed:
+        raise Retry(_backoff(min(p.attempts for p in pending if p.name in failed)))
+    if len(pending) == DELETE_BLOBS_LIMIT:
+        raise Retry(0)
+
+
+class Worker:
+    """Polls the job table and dispatches jobs to handlers(app_worker, job)."""
+
+    def __init__(self, app, storage=None, concurrency=None, poll_interval=None):
+        self.app = app
+        self._storage = storage
+        self.concurrency = concurrency or app.config.get('WORKER_CONCURRENCY', 2)
+        self.poll_interval = poll_interval or app.config.get('WORKER_POLL_INTERVAL', 2.0)
+        self.handlers = {'submit': submit_model, 'finalize': finalize_model, 'delete_blobs': delete_blobs,
+                         'compress': compress_model}
+        # Per-kind caps within this process, e.g. concurrent Tripo submissions
+        self.slots = {kind: threading.BoundedSemaphore(app.config.get(f'{kind.upper()}_CONCURRENCY', self.concurrency))
+                      for kind in self.handlers}
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def storage(self):
+        return self._storage or get_storage(self.app)
+
+    def run_job(self, job):
+        handler = self.handlers[job.kind]
+        kind, key = job.kind, job.key
+        with metrics.trace() as trace:
+            try:
+                with Lease(self.app, job) as job.lease:
+                    handler(self, job)
+            except LeaseLost as e:
+                # The job belongs to whoever reclaimed it now; leave its row alone
+                outcome = 'lost'
+                db.session.rollback()
+                logger.error(f"Job {job.id} ({job.key}) abandoned: {str(e)}")
+            except Retry as r:
+                outcome = 'retry'
+                db.session.rollback()
+                job.attempts -= 1
+                job.state = JOB_PENDING
+                job.run_at = utcnow() + datetime.timedelta(seconds=r.delay)
+            except Exception as e:
+                outcome = 'error'
+                db.session.rollback()
+                logger.error(f"Job {job.id} ({job.key}) failed on attempt {job.attempts}: {str(e)}")
+                job.last_error = str(e)[:2000]
+                if job.attempts >= MAX_ATTEMPTS:
+                    job.state = JOB_FAILED
+                    self.on_give_up(job)
+                else:
+                    job.state = JOB_PENDING
+                    job.run_at = utcnow() + datetime.timedelta(seconds=_backoff(job.attempts))
+            else:
+                outcome = 'done'
+                job.state = JOB_DONE
+            if outcome != 'lost':
+                job.locked_until = None
+                db.session.commit()
+        elapsed = time.perf_counter() - trace.started
+        metrics.JOB_SECONDS.labels(kind, outcome).observe(elapsed)
+        metrics.JOBS_TOTAL.labels(kind, outcome).inc()
+        # Polls that only say "still running" are the bulk of jobs; sample them like requests
+        if outcome == 'error' or metrics.should_log(0, elapsed, self.app.config):
+            metrics.logger.info(json.dumps(dict({'event': 'job', 'kind': kind, 'key': key, 'outcome': outcome,
+                                                 'ms': round(elapsed * 1000, 1)}, **trace.summary())))
+
+    def on_give_up(self, job):
+        model = db.session.get(Model, job.model_id) if job.model_id else None
+        if model and model.state in (STATUS_QUEUED, STATUS_RUNNING):
+            model.set_status(STATUS_FAILED)
+            model.error = f"Gave up after {job.attempts} attempts: {job.last_error}"[:512]
+            # Let the next upload of this image submit again instead of waiting on us
+            Generation.query.filter_by(id=model.generation_id, owner_model_id=model.id,
+                                       status=STATUS_RUNNING).update({Generation.status: STATUS_FAILED})
+
+    def run_once(self):
+        """Claim and run a single job. Returns False when nothing was due."""
+        kinds = [kind for kind, slot in self.slots.items() if slot.acquire(blocking=False)]
+        claimed_kind = None
+        try:
+            with self.app.app_context():
+                job = claim_job(kinds) if kinds else None
+                if job is not None:
+                    claimed_kind = job.kind
+                for kind in kinds:
+                    if kind != claimed_kind:
+                        self.slots[kind].release()
+                if job is None:
+                    return False
+                self.run_job(job)
+                return True
+        finally:
+            if claimed_kind is not None:
+                self.slots[claimed_kind].release()
+
+    def reconcile(self):
+        """Make sure every queued model has a submit job, every unfinished
+        Tripo task has a finalize job, and leftover blob deletions get retried.
+        Also prunes finished jobs older than JOB_RETENTION_SECONDS."""
+        with self.app.app_context():
+            prune_jobs(self.app.config.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+            queued = (db.session.query(Model.id)
+                      .outerjoin(Job, and_(Job.kind == 'submit', Job.model_id == Model.id))
+                      .filter(Model.status == STATUS_QUEUED, Job.id.is_(None))
+                      .all())
+            for (model_id,) in queued:
+                enqueue('submit', f'submit:{model_id}', model_id=model_id)
+            running = (db.session.query(Model.id)
+                       .outerjoin(Job, and_(Job.kind == 'finalize', Job.model_id == Model.id))
+                       .filter(Model.task_id.isnot(None), Model.model_url.is_(None),
+                               or_(Model.status.is_(None), Model.status == STATUS_RUNNING),
+                               Job.id.is_(None))
+                       .all())
+            for (model_id,) in running:
+                enqueue('finalize', f'finalize:{model_id}', model_id=model_id)
+            if db.session.query(BlobDeletion.id).first() is not None:
+                schedule_blob_deletion()
+            return len(queued) + len(running)
+
+    def _loop(self, reconciler):
+        next_reconcile = 0
+        while not self._stop.is_set():
+            try:
+                if reconciler and time.monotonic() >= next_reconcile:
+                    self.reconcile()
+                    next_reconcile = time.monotonic() + self.app.config.get('WORKER_RECONCILE_INTERVAL', 30)
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Worker loop error: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._loop, args=(i == 0,), name=f'job-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+
+def stream_to_storage(response, storage, tmp_name, name_for_md5, content_type, chunk_size, cache_control=None):
+    """Copy a streamed HTTP response into storage, holding at most about
+    chunk_size bytes in memory. Returns the final object name.
+
+    The bytes go to `tmp_name` first and are only copied to their final
+    name, name_for_md5(hex digest), once length and MD5 check out, so the
+    final object never holds a partial upload.
+    """
+    writer = storage.open_writer(tmp_name, content_type=content_type, chunk_size=chunk_size,
+                                 cache_control=cache_control)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        for chunk in response.iter_content(chunk_size=READ_SIZE):
+            md5.update(chunk)
+            size += len(chunk)
+            writer.write(chunk)
+        expected = response.headers.get('Content-Length')
+        if expected and 'Content-Encoding' not in response.headers and int(expected) != size:
+            raise IOError(f"Truncated download of {tmp_name}: got {size} of {expected} bytes")
+        writer.close()
+        stored, digest = storage.md5(tmp_name), base64.b64encode(md5.digest()).decode()
+        if stored != digest:
+            raise IOError(f"Checksum mismatch for {tmp_name}: {stored} != {digest}")
+        name = name_for_md5(md5.hexdigest())
+        storage.copy(tmp_name, name)
+    finally:
+        try:
+            writer.close()
+            storage.delete(tmp_name)
+        except Exception as e:
+            logger.warning(f"Could not clean up {tmp_name}: {str(e)}")
+    return name
+
+
+def glb_object_name(model, md5_hex):
+    """Content-addressed GLB name: a given name always holds the same bytes,
+    so it can be cached forever (GLB_CACHE_CONTROL)."""
+    return f'models/{model.user_id}/{model.id}-{md5_hex[:16]}.glb'
+
+
+def generation_params(config):
+    """Tripo task parameters that determine the output, apart from the image itself."""
+    return {
+        "type": "image_to_model",
+        "model_version": config.get('TRIPO_MODEL_VERSION', 'v2.5-20250123'),
+        "texture": config.get('TRIPO_TEXTURE', True),
+        "pbr": config.get('TRIPO_PBR', False),
+    }
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def claim_generation(model, params, storage):
+    """Attach `model` to the Generation for its image and params.
+
+    Returns True if this model must submit the Tripo task itself, False if it
+    was coalesced onto an existing finished or in-flight generation.
+    """
+    key = params_hash(params)
+    generation = Generation.query.filter_by(image_sha256=model.image_sha256, params_hash=key).first()
+    if generation is None:
+        generation = Generation(image_sha256=model.image_sha256, params_hash=key,
+                                owner_model_id=model.id, status=STATUS_RUNNING)
+        db.session.add(generation)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another upload of the same image got there first
+            db.session.rollback()
+            raise Retry(1)
+    model.generation_id = generation.id
+    db.session.commit()
+
+    if generation.owner_model_id == model.id and generation.status == STATUS_RUNNING:
+        return generation.task_id is None
+    if generation.status == STATUS_SUCCEEDED and generation.model_object \
+            and storage.exists(generation.model_object):
+        return False
+    if generation.status == STATUS_RUNNING and generation.task_id:
+        return False
+    stale = generation.updated_at and utcnow() - generation.updated_at > datetime.timedelta(seconds=LEASE_SECONDS * 2)
+    if generation.status == STATUS_RUNNING and not stale:
+        # The owner is still creating the task; pick up its task_id shortly
+        raise Retry(5)
+    # Failed, abandoned, or its GLB is gone: take it over and submit again
+    taken = Generation.query.filter(Generation.id == generation.id,
+                                    Generation.updated_at == generation.updated_at).update(
+        {Generation.owner_model_id: model.id, Generation.status: STATUS_RUNNING,
+         Generation.task_id: None, Generation.model_object: None, Generation.updated_at: utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    if not taken:
+        raise Retry(1)
+    return True
+
+
+def prepare_image(worker, model, image_name):
+    """Replace the stored upload with its normalized version (oriented,
+    downscaled, metadata stripped) and store a thumbnail. Returns the
+    normalized bytes."""
+    app = worker.app
+    storage = worker.storage
+    raw = storage.read(image_name)
+    if not model.image_sha256:
+        # Direct uploads (/api/uploads) are first read here; dedup hashes the original bytes
+        model.image_sha256 = hashlib.sha256(raw).hexdigest()
+    prepared = prepare_in_pool(raw, workers=app.config.get('IMAGE_PROCESSES', 2),
+                               max_side=app.config.get('TRIPO_MAX_IMAGE_SIDE', 2048),
+                               thumb_side=app.config.get('THUMBNAIL_SIDE', 256))
+    storage.upload_bytes(image_name, prepared['image'], content_type=prepared['content_type'])
+    model.thumbnail_url = storage.upload_bytes(f'thumbnails/{model.user_id}/{model.id}.webp',
+                                               prepared['thumbnail'],
+                                               content_type=prepared['thumbnail_content_type'])
+    db.session.commit()
+    return prepared['image']
+
+
+def _task_may_exist(error):
+    """Whether a failed create_task call could still have started a task."""
+    if isinstance(error, requests.HTTPError):
+        status_code = error.response.status_code if error.response is not None else None
+        return status_code is not None and status_code >= 500 and status_code not in CREATE_TASK_RETRY_STATUSES
+    return request_was_sent(error)
+
+
+def submit_model(worker, job):
+    """Send a queued model's image to Tripo and start its image-to-3D task.
+
+    The job key makes this run at most once per model at a time, and a model
+    that already has a task_id is never submitted again, so retries after a
+    failure don't start a second (billed) generation. An image already
+    generated (or being generated) with the same parameters reuses that
+    task instead; see claim_generation(). The first run normalizes the image
+    and makes its thumbnail (prepare_image()); an undecodable upload fails
+    the model without reaching Tripo.
+    """
+    app = worker.app
+    model = db.session.get(Model, job.model_id)
+    if model is None or model.state != STATUS_QUEUED:
+        return
+    if model.task_id:
+        model.set_status(STATUS_RUNNING)
+        db.session.commit()
+        enqueue('finalize', f'finalize:{model.id}', model_id=model.id)
+        return
+
+    storage = worker.storage
+    image_name = storage.name_from_url(model.image_url)
+    params = generation_params(app.config)
+    image_bytes = None
+    generation = None
+
+    if not model.thumbnail_url:
+        try:
+            image_bytes = prepare_image(worker, model, image_name)
+        except ImageError as e:
+            model.set_status(STATUS_FAILED)
+            model.error = str(e)[:512]
+            db.session.commit()
+            return
+
+    if app.config.get('DEDUPLICATE_GENERATIONS', True):
+        if not model.image_sha256:
+            image_bytes = image_bytes or storage.read(image_name)
+            model.image_sha256 = hashlib.sha256(image_bytes).hexdigest()
+        if not claim_generation(model, params, storage):
+            generation = db.session.get(Generation, model.generation_id)
+            model.task_id = generation.task_id
+            model.set_status(STATUS_RUNNING)
+            db.session.commit()
+            logger.info(f"Model {model.id} reuses generation {generation.id} (task {generation.task_id})")
+            enqueue('finalize', f'finalize:{model.id}', model_id=model.id)
+            return
+        generation = db.session.get(Generation, model.generation_id)
+
+    tripo = get_tripo_client(app)
+    try:
+        image_bytes = image_bytes or storage.read(image_name)
+        # prepare_image() re-encoded the stored image as JPEG or PNG
+        image_format = 'png' if sniff_format(image_bytes) == 'png' else 'jpeg'
+        file_type = 'png' if image_format == 'png' else 'jpg'
+        base_name = os.path.splitext(image_name.rsplit('/', 1)[-1])[0]
+        image_token = tripo.upload_image(f"{base_name}.{file_type}", image_bytes, CONTENT_TYPES[image_format])
+        payload = dict(params, file={
+            "type": file_type,
+            "file_token": image_token
+        })
+        # A worker that reclaimed this job after our lease ran out would submit too
+        job.lease.check()
+        try:
+            task_id = tripo.create_task(payload)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            if not _task_may_exist(e):
+                raise
+            # Tripo may have started (and billed) a task we never heard about;
+            # submitting again could start a second one, so stop here
+            model.set_status(STATUS_FAILED)
+            model.error = f"No answer from Tripo when creating the task, it may still run: {str(e)}"[:512]
+            if generation is not None:
+                generation.status = STATUS_FAILED
+            db.session.commit()
+            logger.error(f"Submit of model {model.id} is ambiguous, not retrying: {str(e)}")
+            return
+    except (TripoError, requests.HTTPError) as e:
+        status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+        if isinstance(e, requests.HTTPError) and (status_code is None or status_code >= 500 or status_code == 429):
+            raise
+        # Rejected by Tripo (bad image, quota, 403): retrying won't help
+        model.set_status(STATUS_FAILED)
+        model.error = f"Tripo rejected the task: {str(e)}"[:512]
+        if generation is not None:
+            generation.status = STATUS_FAILED
+        db.session.commit()
+        logger.error(f"Submit failed for model {model.id}: {str(e)}")
+        return
+
+    # Conditional, so a task that somehow raced another submit never replaces the recorded one
+    recorded = Model.query.filter(Model.id == model.id, Model.task_id.is_(None)).update(
+        {Model.task_id: task_id}, synchronize_session=False)
+    if not recorded:
+        db.session.rollback()
+        logger.error(f"Model {model.id} already has a task; duplicate task {task_id} ignored")
+        return
+    model.task_id = task_id
+    model.set_status(STATUS_RUNNING)
+    model.progress = 0
+    if generation is not None:
+        generation.task_id = task_id
+    db.session.commit()
+    logger.info(f"Model {model.id} submitted as task {task_id}")
+    enqueue('finalize', f'finalize:{model.id}', model_id=model.id, delay=poll_delay(model, app.config))
+
+
+def poll_delay(model, config):
+    """Seconds until the next status poll of a running task.
+
+    The finish time is extrapolated from the progress reported since
+    started_at, and the next poll lands about halfway there, clamped to
+    FINALIZE_POLL_INTERVAL..FINALIZE_POLL_MAX_INTERVAL. With the Tripo
+    webhook configured polling only covers lost notifications, so it waits
+    FINALIZE_WEBHOOK_POLL_INTERVAL instead, unless a notification already
+    said the task finished and the status endpoint just hasn't caught up.
+    """
+    low = config.get('FINALIZE_POLL_INTERVAL', 5)
+    high = max(low, config.get('FINALIZE_POLL_MAX_INTERVAL', 60))
+    if model.notified_at:
+        return low
+    if config.get('TRIPO_WEBHOOK_SECRET'):
+        return max(low, config.get('FINALIZE_WEBHOOK_POLL_INTERVAL', 300))
+    progress = model.progress or 0
+    if not model.started_at or progress <= 0 or progress >= 100:
+        return low
+    elapsed = (utcnow() - model.started_at).total_seconds()
+    remaining = elapsed * (100 - progress) / progress
+    return min(high, max(low, remaining / 2))
+
+
+def record_task_event(task_id, status, progress):
+    """Apply a Tripo task notification (/api/tripo/webhook) to the models
+    waiting on `task_id`. Returns how many there were.
+
+    Notifications can repeat or arrive out of order, so progress only moves
+    forward and models that already succeeded or failed are left alone. A
+    finished task (any status but queued/running) stamps notified_at and
+    makes each model's finalize job due now; finalize confirms with Tripo
+    before storing the GLB, and its job key keeps that to one run however
+    many notifications arrive. A finalize job that is running right now
+    sees notified_at when it schedules its next poll.
+    """
+    waiting = and_(Model.task_id == task_id, Model.model_url.is_(None), Model.status == STATUS_RUNNING)
+    model_ids = [model_id for (model_id,) in db.session.query(Model.id).filter(waiting)]
+    if not model_ids:
+        return 0
+    Model.query.filter(waiting, Model.progress < progress).update({Model.progress: progress},
+                                                                  synchronize_session=False)
+    if status not in ("queued", "running"):
+        now = utcnow()
+        Model.query.filter(waiting).update({Model.notified_at: now}, synchronize_session=False)
+        Job.query.filter(Job.key.in_([f'finalize:{model_id}' for model_id in model_ids]),
+                         Job.state == JOB_PENDING, Job.run_at > now).update({Job.run_at: now},
+                                                                            synchronize_session=False)
+    db.session.commit()
+    if status not in ("queued", "running"):
+        for model_id in model_ids:
+            # No-op when the job exists, as it normally does since submit
+            enqueue('finalize', f'finalize:{model_id}', model_id=model_id)
+    return len(model_ids)
+
+
+def finalize_model(worker, job):
+    """Poll the Tripo task once; on success copy the GLB into storage. Runs
+    when a webhook says the task finished, and otherwise every poll_delay()
+    as a fallback."""
+    app = worker.app
+    model = db.session.get(Model, job.model_id)
+    if model is None or model.model_url or not model.task_id:
+        return
+
+    storage = worker.storage
+    generation = db.session.get(Generation, model.generation_id) if model.generation_id else None
+
+    # Same image and parameters already finished for another model: server-side copy
+    if generation is not None and generation.status == STATUS_SUCCEEDED and generation.model_object:
+        md5 = storage.md5(generation.model_object)
+        if md5 is not None:
+            model_filename = glb_object_name(model, base64.b64decode(md5).hex())
+            storage.copy(generation.model_object, model_filename)
+            _mark_succeeded(worker, model, storage.public_url(model_filename), generation, model_filename)
+            logger.info(f"Model {model.id} copied from {generation.model_object}")
+            return
+
+    tripo = get_tripo_client(app)
+    data = tripo.get_task(model.task_id)
+    status = data["status"]
+    progress = data.get("progress", 0)
+    logger.debug(f"Task {model.task_id} status: {status}, Progress: {progress}%")
+
+    if status in ("queued", "running"):
+        model.set_status(STATUS_RUNNING)
+        # A webhook may already have reported more
+        model.progress = max(model.progress or 0, progress)
+        # Also reloads notified_at, in case a webhook landed while we polled
+        db.session.commit()
+        raise Retry(poll_delay(model, app.config))
+
+    if status != "success":
+        model.set_status(STATUS_FAILED)
+        model.error = (data.get("message") or f"Task {status}")[:512]
+        if generation is not None and generation.task_id == model.task_id:
+            generation.status = STATUS_FAILED
+        db.session.commit()
+        logger.error(f"Task failed or canceled: {status}, Reason: {model.error}")
+        return
+
+    result = data.get("result") or {}
+    glb_url = (result.get("model", {}).get("url") or
+               result.get("pbr_model", {}).get("url"))
+    if not glb_url:
+        model.set_status(STATUS_FAILED)
+        model.error = "No GLB URL in response"
+        db.session.commit()
+        logger.error(f"Task succeeded but no valid model URL in response: {data}")
+        return
+
+    with metrics.span('tripo', 'glb_transfer'), tripo.download(glb_url) as glb_response:
+        model_filename = stream_to_storage(glb_response, storage, f'models/{model.user_id}/{model.id}.glb.partial',
+                                           lambda md5_hex: glb_object_name(model, md5_hex), 'model/gltf-binary',
+                                           app.config.get('TRANSFER_CHUNK_SIZE', DEFAULT_CHUNK_SIZE),
+                                           cache_control=GLB_CACHE_CONTROL)
+    _mark_succeeded(worker, model, storage.public_url(model_filename), generation, model_filename)
+    logger.info(f"Model {model.id} uploaded to {model.model_url}")
+
+
+def _mark_succeeded(worker, model, model_url, generation, model_filename):
+    model.model_url = model_url
+    model.set_status(STATUS_SUCCEEDED)
+    model.progress = 100
+    model.error = None
+    if generation is not None and (generation.task_id == model.task_id or generation.status == STATUS_SUCCEEDED):
+        generation.status = STATUS_SUCCEEDED
+        if not generation.model_object:
+            generation.model_object = model_filename
+    db.session.commit()
+    if worker.app.config.get('GLB_GZIP', True):
+        enqueue('compress', f'compress:{model.id}', model_id=model.id)
+
+
+def compress_model(worker, job):
+    """Store a gzip-encoded copy of a finished GLB next to it (<name>.gz),
+    served by /models/<id>/file to clients that accept gzip."""
+    model = db.session.get(Model, job.model_id)
+    if model is None or not model.model_url or model.model_gz_url:
+        return
+    storage = worker.storage
+    name = storage.name_from_url(model.model_url)
+    chunk_size = worker.app.config.get('TRANSFER_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    with storage.open_reader(name, chunk_size=chunk_size) as reader, \
+            storage.open_writer(name + '.gz', content_type='model/gltf-binary', chunk_size=chunk_size,
+                                cache_control=GLB_CACHE_CONTROL) as writer:
+        # mtime=0 keeps the output, and so its ETag, deterministic
+        with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=9, mtime=0) as gz:
+            for chunk in iter(lambda: reader.read(READ_SIZE), b''):
+                gz.write(chunk)
+    model.model_gz_url = storage.public_url(name + '.gz')
+    db.session.commit()
+
+
+def start_worker(app, **kwargs):
+    return Worker(app, **kwargs).start()
+
+
+if __name__ == '__main__':
+    from app import app
+    worker = start_worker(app)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        worker.stop()